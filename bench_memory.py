@@ -0,0 +1,141 @@
+"""
+Speicher-Benchmark für die Bildkonvertierung.
+
+Erzeugt synthetische Bilder verschiedener Größenklassen (JPEG und PNG) und konvertiert jedes
+in einem eigenen Prozess wie der Bot mit convert_image() in alle OUTPUT_FORMATS (einmal
+dekodieren, parallel kodieren). Ausgegeben wird der Spitzenwert des Arbeitsspeichers
+(Peak-RSS) pro Größenklasse, abzüglich des Grundbedarfs des Prozesses.
+
+Mit --check-formats wird stattdessen geprüft, dass die WebP-Ausgabe bytegleich bleibt, wenn
+zusätzlich AVIF parallel aus demselben dekodierten Bild kodiert wird.
+
+Aufruf:
+    python bench_memory.py
+    python bench_memory.py --sizes 12 48 100 --formats JPEG
+    python bench_memory.py --check-formats
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+# bot.py erwartet diese Variable beim Import
+os.environ.setdefault("ADMINISTRATOR_IDS", "0")
+
+DEFAULT_SIZES = [1, 12, 24, 48, 100]  # Megapixel
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss ist unter Linux in KiB, unter macOS in Bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def generate(path: str, megapixels: float, image_format: str):
+    from PIL import Image
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    tile = Image.effect_noise((512, 512), 48).convert("RGB")
+    img = Image.new("RGB", (width, height))
+    for x in range(0, width, 512):
+        for y in range(0, height, 512):
+            img.paste(tile, (x, y))
+    img.save(path, format=image_format, quality=90)
+
+
+def worker(path: str):
+    import asyncio
+    import bot
+    from PIL import Image
+    Image.init()
+    outputs = {image_format: f"{path}.{image_format}" for image_format in bot.output_formats()}
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    encoded = asyncio.run(bot.convert_image(path, outputs))
+    result = {
+        "success": encoded is not None,
+        "seconds": time.perf_counter() - started,
+        "baseline_mb": baseline,
+        "peak_mb": peak_rss_mb(),
+    }
+    for output_path in outputs.values():
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    print(json.dumps(result))
+
+
+def check_formats(tmp: str, sizes: list) -> bool:
+    import asyncio
+    import bot
+    ok = True
+    for megapixels in sizes:
+        path = os.path.join(tmp, f"check_{megapixels:g}mp.jpeg")
+        generate(path, megapixels, "JPEG")
+        webp_only = asyncio.run(bot.convert_image(path, {"webp": path + ".solo.webp"}))
+        with open(path + ".solo.webp", "rb") as f:
+            reference = f.read()
+        # Mehrere Durchläufe, da sich parallele Encoder nur bei passendem Timing in die Quere kommen
+        identical = True
+        for _ in range(5):
+            both = asyncio.run(bot.convert_image(path, {"webp": path + ".webp", "avif": path + ".avif"}))
+            with open(path + ".webp", "rb") as f:
+                identical = identical and f.read() == reference
+        ok = ok and identical and webp_only is not None and both is not None and "avif" in both
+        print(f"{megapixels:>6g} MP  WebP bytegleich: {'ja' if identical else 'NEIN'}  "
+              f"AVIF: {'ok' if both and 'avif' in both else 'fehlgeschlagen'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak-RSS der WebP-Konvertierung pro Bildgröße messen.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="Größenklassen in Megapixeln.")
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"], help="Eingabeformate.")
+    parser.add_argument("--check-formats", action="store_true", help="WebP mit und ohne AVIF vergleichen.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.check_formats:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            sys.exit(0 if check_formats(tmp, [min(size, 12) for size in args.sizes[:2]]) else 1)
+
+    if args.worker:
+        worker(args.worker)
+        return
+
+    print(f"{'Format':<6} {'MP':>6} {'Datei MB':>9} {'Peak MB':>8} {'Zusatz MB':>10} {'Zeit s':>7}  Ergebnis")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        for image_format in args.formats:
+            for megapixels in args.sizes:
+                path = os.path.join(tmp, f"bench_{megapixels:g}mp.{image_format.lower()}")
+                # Erzeugen in einem eigenen Prozess, damit der Messprozess sauber startet
+                subprocess.run(
+                    [sys.executable, "-c", f"import bench_memory as b; b.generate({path!r}, {megapixels}, {image_format!r})"],
+                    check=True,
+                    cwd=tmp,
+                    env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))},
+                )
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--worker", path],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                    cwd=tmp,
+                    env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))},
+                )
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                print(
+                    f"{image_format:<6} {megapixels:>6g} {os.path.getsize(path) / 1e6:>9.1f} "
+                    f"{result['peak_mb']:>8.0f} {result['peak_mb'] - result['baseline_mb']:>10.0f} "
+                    f"{result['seconds']:>7.2f}  {'ok' if result['success'] else 'abgelehnt'}"
+                )
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
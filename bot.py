@@ -1,21 +1,33 @@
+from __future__ import annotations
+
+import time
+
+_MODULE_LOAD_START = time.perf_counter()
+
 import os
+import sys
 import asyncio
 import argparse
-import aioftp
+import importlib
+import collections
+import contextlib
+import datetime
+import json
+import re
+import functools
+import hashlib
+import secrets
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, NamedTuple
 from dotenv import load_dotenv
-from PIL import Image
-
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    CallbackQueryHandler,
-    filters,
-    CallbackContext,
-)
-from telegram.ext.filters import User
+
+# Schwere Abhängigkeiten (Pillow, aioftp, telegram.ext) werden erst bei der ersten Verwendung
+# über lazy_import() geladen, damit der Start des Dynos nicht auf sie warten muss.
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import CallbackContext
 
 # .env laden, falls vorhanden
 if os.path.exists(".env"):
@@ -25,16 +37,91 @@ if os.path.exists(".env"):
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBURL = os.getenv("WEBURL")
 FTP_HOST = os.getenv("FTP_HOST")
+FTP_PORT = int(os.getenv("FTP_PORT", 21))
 FTP_USER = os.getenv("FTP_USER")
 FTP_PASS = os.getenv("FTP_PASS")
 LOCAL_DOWNLOAD_PATH = "./downloads/"
 ADMINISTRATOR_IDS = [int(i) for i in os.getenv("ADMINISTRATOR_IDS").split(",")]
+ENCODER_WORKERS = int(os.getenv("ENCODER_WORKERS", 2))
+# Telegram erlaubt ca. 30 Nachrichten/s insgesamt und ca. 1 Nachricht/s pro Chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", 10))
+# Galerie-Manifest für die Webseite (im FTP-Wurzelverzeichnis)
+MANIFEST_NAME = os.getenv("MANIFEST_NAME", "gallery.json")
+MANIFEST_DEBOUNCE = float(os.getenv("MANIFEST_DEBOUNCE", 10))
+IMAGE_EXTENSIONS = (".webp", ".jpg", ".jpeg", ".png")
+# Grenzen für das Dekodieren von Bildern (0 = keine Grenze)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 60_000_000))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", 50 * 1024 * 1024))
+# Längste Kante der Ausgabe; größere Bilder werden verkleinert (Standard 0 = Originalauflösung)
+MAX_IMAGE_EDGE = int(os.getenv("MAX_IMAGE_EDGE", 0))
+# Vorschaubilder zu /list (LIST_PREVIEWS=0 schaltet sie ab)
+LIST_PREVIEWS = os.getenv("LIST_PREVIEWS", "1") == "1"
+THUMBNAIL_EDGE = int(os.getenv("THUMBNAIL_EDGE", 320))
+# Ausgabeformate, z.B. "webp,avif". WebP bleibt die Hauptdatei, weitere Formate liegen als
+# Geschwisterdateien mit gleichem Namen daneben (Titel_….avif)
+OUTPUT_FORMATS = ["webp"] + [
+    f.strip().lower() for f in os.getenv("OUTPUT_FORMATS", "webp").split(",") if f.strip() and f.strip().lower() != "webp"
+]
+AVIF_QUALITY = int(os.getenv("AVIF_QUALITY", 75))
+output_formats_checked = False
+# Ablage auf dem FTP: flat, year oder hash (siehe remote_path())
+FTP_LAYOUT = os.getenv("FTP_LAYOUT", "flat")
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", 50))
+# Ruhefenster für Hintergrundaufgaben, z.B. "01:00-06:00,13:00-14:00"
+BACKGROUND_WINDOWS = os.getenv("BACKGROUND_WINDOWS", "01:00-06:00")
+BACKGROUND_TIMEZONE = os.getenv("BACKGROUND_TIMEZONE", "Europe/Berlin")
+BACKGROUND_CPU_SLOTS = int(os.getenv("BACKGROUND_CPU_SLOTS", 1))
+BACKGROUND_FTP_SLOTS = int(os.getenv("BACKGROUND_FTP_SLOTS", 1))
+BACKGROUND_POLL_INTERVAL = int(os.getenv("BACKGROUND_POLL_INTERVAL", 30))
+# Sekunden ohne Nutzeraktivität, bevor Hintergrundaufgaben (weiter)laufen
+INTERACTIVE_GRACE = int(os.getenv("INTERACTIVE_GRACE", 120))
+ORPHAN_MAX_AGE = int(os.getenv("ORPHAN_MAX_AGE", 3600))
+# Maximale Anzahl paralleler FTP-Verbindungen für Sammelaktionen
+FTP_BATCH_CONNECTIONS = int(os.getenv("FTP_BATCH_CONNECTIONS", 3))
+MONTHS = [
+    "Januar", "Februar", "März", "April", "Mai", "Juni",
+    "Juli", "August", "September", "Oktober", "November", "Dezember",
+]
 
 os.makedirs(LOCAL_DOWNLOAD_PATH, exist_ok=True)
 
 user_data = {}
 ftp_client = None
 inactivity_timer = None
+encoder_executor = None
+background_executor = None
+outbox = None
+ftp_lock = asyncio.Lock()
+gallery_entries = None
+manifest_timer = None
+manifest_task = None
+manifest_lock = asyncio.Lock()
+remote_locations = {}
+known_directories = set()
+thumbnail_cache = {}
+background_queue = collections.deque()
+background_running = None
+last_interaction = 0.0
+maintenance_date = None
+active_uploads = set()  # Fotos laufender Upload-Dialoge, die die Wartung nicht löschen darf
+import_times = {}
+
+
+def lazy_import(module_name: str):
+    """
+    Importiert ein Modul erst bei der ersten Verwendung und merkt sich die dafür benötigte Zeit.
+    Bereits geladene Module werden direkt zurückgegeben.
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_times[module_name] = time.perf_counter() - started
+    print(f"Modul {module_name} geladen ({import_times[module_name] * 1000:.0f} ms).")
+    return module
 
 
 def encode_title(title: str) -> str:
@@ -50,9 +137,10 @@ async def ftp_connect():
     Stellt eine Verbindung zum FTP-Server her bzw. erneuert diese, wenn sie abgebrochen wurde.
     """
     global ftp_client
+    aioftp = lazy_import("aioftp")
     if ftp_client is None:
         ftp_client = aioftp.Client()
-        await ftp_client.connect(FTP_HOST)
+        await ftp_client.connect(FTP_HOST, FTP_PORT)
         await ftp_client.login(FTP_USER, FTP_PASS)
         print("FTP-Verbindung aufgebaut.")
     else:
@@ -62,20 +150,88 @@ async def ftp_connect():
         except (aioftp.StatusCodeError, ConnectionResetError):
             print("FTP-Verbindung verloren, erneuere die Verbindung.")
             ftp_client = aioftp.Client()
-            await ftp_client.connect(FTP_HOST)
+            await ftp_client.connect(FTP_HOST, FTP_PORT)
             await ftp_client.login(FTP_USER, FTP_PASS)
     return ftp_client
 
 
 async def ftp_disconnect():
     """
-    Trennt die Verbindung zum FTP-Server.
+    Trennt die Verbindung zum FTP-Server. Wartet dafür auf ftp_lock, damit keine laufende
+    Übertragung eines Handlers oder des Manifests abgeschnitten wird.
     """
     global ftp_client
-    if ftp_client is not None:
-        await ftp_client.quit()
-        ftp_client = None
-        print("FTP-Verbindung getrennt.")
+    async with ftp_lock:
+        if ftp_client is not None:
+            await ftp_client.quit()
+            ftp_client = None
+            print("FTP-Verbindung getrennt.")
+
+
+@contextlib.asynccontextmanager
+async def ftp_session(client=None):
+    """
+    Liefert die gemeinsame FTP-Verbindung (exklusiv über ftp_lock) oder, falls übergeben,
+    eine eigene Verbindung aus einem Batch-Worker.
+    """
+    if client is not None:
+        yield client
+        return
+    async with ftp_lock:
+        yield await ftp_connect()
+
+
+async def open_ftp_client():
+    """
+    Baut eine zusätzliche, eigenständige FTP-Verbindung auf (für parallele Batch-Operationen).
+    """
+    aioftp = lazy_import("aioftp")
+    client = aioftp.Client()
+    await client.connect(FTP_HOST, FTP_PORT)
+    await client.login(FTP_USER, FTP_PASS)
+    return client
+
+
+async def close_ftp_client(client):
+    """
+    Schließt eine mit open_ftp_client geöffnete Verbindung. Ist sie bereits vom Server
+    gekappt worden, wird der Socket nur noch lokal geschlossen.
+    """
+    try:
+        await client.quit()
+    except Exception as e:
+        print(f"FTP-Verbindung nicht sauber beendet: {e}")
+        client.close()
+
+
+async def run_ftp_batch(operations: list, limit: int = None) -> list:
+    """
+    Führt FTP-Operationen der Form (Funktion, *Argumente) mit höchstens `limit` parallelen
+    Verbindungen aus. Jede Funktion erhält die Verbindung ihres Workers als `client`.
+    Gibt die Ergebnisse in der Reihenfolge der Operationen zurück.
+    """
+    limit = limit or FTP_BATCH_CONNECTIONS
+    results = [False] * len(operations)
+    pending = collections.deque(enumerate(operations))
+
+    async def worker():
+        try:
+            client = await open_ftp_client()
+        except Exception as e:
+            print(f"Fehler beim Aufbau einer Batch-Verbindung: {e}")
+            return
+        try:
+            while pending:
+                index, (func, *args) = pending.popleft()
+                results[index] = await func(*args, client=client)
+        finally:
+            try:
+                await client.quit()
+            except Exception:
+                pass
+
+    await asyncio.gather(*(worker() for _ in range(min(limit, len(operations)))))
+    return results
 
 
 def start_inactivity_timer():
@@ -86,92 +242,1093 @@ def start_inactivity_timer():
     global inactivity_timer
     if inactivity_timer is not None:
         inactivity_timer.cancel()
-    inactivity_timer = asyncio.get_event_loop().call_later(300, asyncio.create_task, ftp_disconnect())
+    inactivity_timer = asyncio.get_event_loop().call_later(300, lambda: asyncio.create_task(ftp_disconnect()))
+
 
+# -----------------------------------------
+#   ABLAGE AUF DEM FTP (OPTIONAL IN UNTERVERZEICHNISSEN)
+# -----------------------------------------
+# FTP_LAYOUT=flat  → /Titel_….webp (Standard)
+# FTP_LAYOUT=year  → /2024/Titel_….webp (ohne Jahr: /ohne-jahr/…)
+# FTP_LAYOUT=hash  → /3f/Titel_….webp (zwei Hex-Zeichen aus dem Dateinamen ohne Endung)
+SHARD_PATTERN = re.compile(r"^(\d{4}|ohne-jahr|[0-9a-f]{2})$")
 
-async def upload_to_ftp(local_path: str, filename: str) -> bool:
+
+def remote_path(file_name: str) -> str:
+    """
+    Zielpfad einer Datei gemäß FTP_LAYOUT. Das Manifest liegt immer im Wurzelverzeichnis.
+    """
+    if FTP_LAYOUT == "flat" or is_manifest_file(file_name):
+        return f"/{file_name}"
+    stem = file_name.rsplit(".", 1)[0]
+    if FTP_LAYOUT == "year":
+        match = DATE_PATTERN.match(parse_filename(file_name)["date"])
+        shard = match.group(2) if match and match.group(2) else "ohne-jahr"
+    else:
+        shard = hashlib.md5(stem.encode()).hexdigest()[:2]
+    return f"/{shard}/{file_name}"
+
+
+def locate(file_name: str) -> str:
+    """
+    Tatsächlicher Pfad einer Datei: bekannt aus der letzten Auflistung (auch während einer
+    Migration) oder sonst der Zielpfad laut FTP_LAYOUT.
+    """
+    return remote_locations.get(file_name) or remote_path(file_name)
+
+
+# Zusatzformate, die einer WebP-Datei bei Umbenennen/Löschen folgen (auch wenn sie in
+# OUTPUT_FORMATS inzwischen abgeschaltet sind)
+SIBLING_FORMATS = ("avif",)
+
+
+def with_extension(file_name: str, image_format: str) -> str:
+    return file_name.rsplit(".", 1)[0] + "." + image_format
+
+
+def is_sibling_file(file_name: str) -> bool:
+    return file_name.rsplit(".", 1)[-1].lower() in SIBLING_FORMATS
+
+
+def sibling_files(file_name: str) -> list:
+    """
+    Geschwisterdateien einer WebP-Datei (z.B. Titel_….avif), die laut letzter Auflistung auf dem FTP liegen.
+    """
+    if not file_name.lower().endswith(".webp"):
+        return []
+    return [
+        with_extension(file_name, image_format) for image_format in SIBLING_FORMATS
+        if with_extension(file_name, image_format) in remote_locations
+    ]
+
+
+async def ensure_remote_directory(client, path: str):
+    """
+    Legt das Verzeichnis einer Zieldatei an, falls es noch nicht bekannt ist.
+    """
+    directory = path.rsplit("/", 1)[0]
+    if directory and directory not in known_directories:
+        try:
+            await client.make_directory(directory)
+        except Exception:
+            # Paralleler Batch-Worker war schneller
+            if not await client.exists(directory):
+                raise
+        known_directories.add(directory)
+
+
+async def upload_to_ftp(local_path: str, filename: str, client=None) -> bool:
     """
     Lädt eine Datei vom local_path unter dem Namen filename auf den FTP-Server hoch.
     """
     try:
-        client = await ftp_connect()
-        print(f"Lade Datei {local_path} hoch als {filename}")
-        
-        # Zielpfad anpassen, damit die Datei direkt im Wurzelverzeichnis landet
-        target_path = f"/{filename}"
-        print(f"Ziel: {target_path}")
+        async with ftp_session(client) as client:
+            print(f"Lade Datei {local_path} hoch als {filename}")
+
+            target_path = remote_path(filename)
+            print(f"Ziel: {target_path}")
 
-        await client.upload(local_path, target_path, write_into=True)
+            await ensure_remote_directory(client, target_path)
+            await client.upload(local_path, target_path, write_into=True)
+            remote_locations[filename] = target_path
 
+        invalidate_thumbnail(filename)
         # Inaktivitäts-Timer neu starten
         start_inactivity_timer()
+        manifest_file_uploaded(filename, os.path.getsize(local_path))
         return True
     except Exception as e:
         print(f"FTP-Upload-Fehler: {e}")
         return False
 
 
-async def rename_ftp_file(old_name: str, new_name: str) -> bool:
+async def rename_ftp_file(old_name: str, new_name: str, client=None) -> bool:
     """
-    Bennent eine Datei auf dem FTP-Server um.
+    Bennent eine Datei auf dem FTP-Server um und verschiebt sie dabei ggf. in das passende
+    Unterverzeichnis. Mit old_name == new_name wird sie nur an ihren Zielpfad verschoben.
     """
     try:
-        client = await ftp_connect()
-        await client.rename(old_name, new_name)
+        async with ftp_session(client) as client:
+            source_path = locate(old_name)
+            target_path = remote_path(new_name)
+            await ensure_remote_directory(client, target_path)
+            if source_path != target_path:
+                await client.rename(source_path, target_path)
+            remote_locations.pop(old_name, None)
+            remote_locations[new_name] = target_path
+            for sibling in sibling_files(old_name):
+                await move_sibling(client, sibling, with_extension(new_name, sibling.rsplit(".", 1)[1]))
+        if old_name != new_name:
+            invalidate_thumbnail(old_name)
+            invalidate_thumbnail(new_name)
         start_inactivity_timer()
-        print(f"Datei {old_name} umbenannt in {new_name}")
+        print(f"Datei {source_path} umbenannt in {target_path}")
+        manifest_file_renamed(old_name, new_name)
         return True
     except Exception as e:
         print(f"Fehler beim Umbenennen der Datei auf dem FTP-Server: {e}")
         return False
 
 
-async def delete_ftp_file(file_name: str) -> bool:
+async def move_sibling(client, old_name: str, new_name: str):
+    """
+    Zieht eine Geschwisterdatei bei einer Umbenennung/Migration nach. Fehler werden nur
+    protokolliert, die Hauptdatei ist zu diesem Zeitpunkt bereits umbenannt.
+    """
+    source_path = locate(old_name)
+    target_path = remote_path(new_name)
+    if source_path == target_path:
+        return
+    try:
+        await client.rename(source_path, target_path)
+        remote_locations.pop(old_name, None)
+        remote_locations[new_name] = target_path
+    except Exception as e:
+        print(f"Fehler beim Umbenennen von {old_name}: {e}")
+
+
+async def delete_ftp_file(file_name: str, client=None) -> bool:
     """
     Löscht eine Datei auf dem FTP-Server.
     """
     try:
-        client = await ftp_connect()
-        await client.remove_file(file_name)
+        async with ftp_session(client) as client:
+            await client.remove_file(locate(file_name))
+            remote_locations.pop(file_name, None)
+            for sibling in sibling_files(file_name):
+                try:
+                    await client.remove_file(locate(sibling))
+                    remote_locations.pop(sibling, None)
+                except Exception as e:
+                    print(f"Fehler beim Löschen von {sibling}: {e}")
+        invalidate_thumbnail(file_name)
         start_inactivity_timer()
+        manifest_file_deleted(file_name)
         return True
     except Exception as e:
         print(f"Fehler beim Löschen der Datei auf dem FTP-Server: {e}")
         return False
 
 
-async def list_ftp_files() -> list:
+async def download_from_ftp(file_name: str, local_path: str, client=None) -> bool:
+    """
+    Lädt eine Datei vom FTP-Server nach local_path herunter.
+    """
+    try:
+        async with ftp_session(client) as client:
+            await client.download(locate(file_name), local_path, write_into=True)
+        start_inactivity_timer()
+        return True
+    except Exception as e:
+        print(f"Fehler beim Download von {file_name}: {e}")
+        return False
+
+
+async def list_ftp_file_sizes():
     """
-    Listet alle Dateien im Root-Verzeichnis des FTP-Servers auf.
+    Listet alle Dateien des Katalogs samt Größe auf ({Name: Bytes}): das Wurzelverzeichnis und
+    die Unterverzeichnisse der Ablage (unabhängig vom aktuellen FTP_LAYOUT, damit auch während
+    einer Migration alle Dateien gefunden werden). Das Manifest und Geschwisterdateien (.avif)
+    werden nicht aufgeführt, ihre Pfade aber in remote_locations vermerkt.
+    Gibt bei einem Fehler None zurück.
     """
     try:
-        client = await ftp_connect()
-        files = []
-        async for path, info in client.list():
-            if info["type"] == "file":
-                files.append(path.name)
+        async with ftp_session() as client:
+            sizes = {}
+            locations = {}
+            directories = ["/"]
+            while directories:
+                directory = directories.pop()
+                async for path, info in client.list(directory):
+                    full_path = "/" + str(path).lstrip("/")
+                    if info["type"] == "file" and not is_manifest_file(path.name):
+                        if not is_sibling_file(path.name):
+                            sizes[path.name] = int(info.get("size", 0))
+                        locations[path.name] = full_path
+                    elif info["type"] == "dir" and directory == "/" and SHARD_PATTERN.match(path.name):
+                        known_directories.add(full_path)
+                        directories.append(full_path)
+        remote_locations.clear()
+        remote_locations.update(locations)
         start_inactivity_timer()
-        return files
+        manifest_catalog_listed(sizes)
+        return sizes
     except Exception as e:
         print(f"Fehler beim Abrufen der Dateien: {e}")
-        return []
+        return None
+
+
+async def list_ftp_files() -> list:
+    """
+    Listet alle Dateien des Katalogs als flache Liste auf.
+    """
+    sizes = await list_ftp_file_sizes()
+    return list(sizes) if sizes else []
+
+
+# -----------------------------------------
+#   DATEINAMEN UND GALERIE-MANIFEST
+# -----------------------------------------
+# Aufbau eines Dateinamens: Titel_Material[_Monat-Jahr][_BxH][_x][_S].webp
+# (_x = nicht verfügbar, _S = Startbild)
+DATE_PATTERN = re.compile(r"^(?:(%s)-)?(\d{4})$|^(%s)$" % ("|".join(MONTHS), "|".join(MONTHS)))
+
+
+def parse_filename(file_name: str) -> dict:
+    """
+    Zerlegt einen Dateinamen in seine Bestandteile (Titel bleibt URL-kodiert).
+    """
+    if "." in file_name:
+        base, extension = file_name.rsplit(".", 1)
+    else:
+        base, extension = file_name, ""
+    parts = base.split("_")
+    start = len(parts) > 1 and parts[-1] == "S"
+    if start:
+        parts.pop()
+    available = not (len(parts) > 1 and parts[-1] == "x")
+    if not available:
+        parts.pop()
+
+    date = dimensions = ""
+    rest = parts[2:]
+    if len(rest) == 1:
+        if DATE_PATTERN.match(rest[0]):
+            date = rest[0]
+        else:
+            dimensions = rest[0]
+    elif rest:
+        date, dimensions = rest[0], "_".join(rest[1:])
+
+    return {
+        "title": parts[0],
+        "material": parts[1] if len(parts) > 1 else "",
+        "date": date,
+        "dimensions": dimensions,
+        "available": available,
+        "start": start,
+        "extension": extension,
+    }
+
+
+def build_filename(meta: dict) -> str:
+    """
+    Setzt einen Dateinamen aus den Bestandteilen von parse_filename() wieder zusammen.
+    """
+    parts = [meta["title"], meta["material"], meta["date"], meta["dimensions"]]
+    if not meta["available"]:
+        parts.append("x")
+    if meta["start"]:
+        parts.append("S")
+    name = "_".join(p for p in parts if p)
+    if meta["extension"]:
+        name += f".{meta['extension']}"
+    return name
+
+
+def is_manifest_file(file_name: str) -> bool:
+    return file_name in (MANIFEST_NAME, MANIFEST_NAME + ".tmp")
+
+
+def manifest_entry(file_name: str, size: int) -> dict:
+    """
+    Eintrag einer Datei im Galerie-Manifest, so wie ihn die Webseite erwartet.
+    """
+    meta = parse_filename(file_name)
+    match = DATE_PATTERN.match(meta["date"]) if meta["date"] else None
+    month = year = None
+    if match:
+        month = match.group(1) or match.group(3)
+        year = int(match.group(2)) if match.group(2) else None
+    return {
+        "file": file_name,
+        "path": locate(file_name),
+        "title": urllib.parse.unquote(meta["title"]).replace("-", " "),
+        "material": meta["material"],
+        "month": month,
+        "year": year,
+        "dimensions": meta["dimensions"].replace("-", "x"),
+        "available": meta["available"],
+        "start": meta["start"],
+        "size": size,
+        "formats": [meta["extension"].lower()] + [name.rsplit(".", 1)[1] for name in sibling_files(file_name)],
+    }
+
+
+def manifest_catalog_listed(sizes: dict):
+    """
+    Übernimmt eine vollständige FTP-Auflistung als Grundlage für das Manifest.
+    """
+    global gallery_entries
+    gallery_entries = dict(sizes)
+
+
+def manifest_file_uploaded(file_name: str, size: int):
+    if is_manifest_file(file_name):
+        return
+    # Geschwisterdateien erscheinen nur als "formats" im Eintrag der WebP-Datei
+    if gallery_entries is not None and not is_sibling_file(file_name):
+        gallery_entries[file_name] = size
+    schedule_manifest_publish()
+
+
+def manifest_file_renamed(old_name: str, new_name: str):
+    global gallery_entries
+    if is_manifest_file(new_name):
+        return
+    if gallery_entries is not None:
+        if old_name in gallery_entries:
+            gallery_entries[new_name] = gallery_entries.pop(old_name)
+        else:
+            # Unbekannte Datei: beim nächsten Veröffentlichen komplett neu auflisten
+            gallery_entries = None
+    schedule_manifest_publish()
+
+
+def manifest_file_deleted(file_name: str):
+    if is_manifest_file(file_name):
+        return
+    if gallery_entries is not None:
+        gallery_entries.pop(file_name, None)
+    schedule_manifest_publish()
+
+
+def schedule_manifest_publish():
+    """
+    Entprellt Änderungen: das Manifest wird erst MANIFEST_DEBOUNCE Sekunden nach der letzten
+    Änderung einmalig hochgeladen.
+    """
+    global manifest_timer
+    if manifest_timer is not None:
+        manifest_timer.cancel()
+    manifest_timer = asyncio.get_event_loop().call_later(MANIFEST_DEBOUNCE, _start_manifest_publish)
+
+
+def _start_manifest_publish():
+    global manifest_task, manifest_timer
+    manifest_timer = None
+    manifest_task = asyncio.create_task(publish_manifest())
+
+
+async def publish_manifest() -> bool:
+    """
+    Schreibt das Manifest und lädt es atomar hoch (erst als .tmp, dann Umbenennung).
+    """
+    global gallery_entries
+    async with manifest_lock:
+        if gallery_entries is None and await list_ftp_file_sizes() is None:
+            return False
+        images = [
+            manifest_entry(name, size)
+            for name, size in sorted(gallery_entries.items())
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        manifest = {"version": 1, "generated": int(time.time()), "images": images}
+        local_path = os.path.join(LOCAL_DOWNLOAD_PATH, MANIFEST_NAME)
+        with open(local_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+
+        temp_name = MANIFEST_NAME + ".tmp"
+        success = await upload_to_ftp(local_path, temp_name)
+        if success and not await rename_ftp_file(temp_name, MANIFEST_NAME):
+            # Manche Server überschreiben beim Umbenennen nicht
+            await delete_ftp_file(MANIFEST_NAME)
+            success = await rename_ftp_file(temp_name, MANIFEST_NAME)
+        os.remove(local_path)
+        if success:
+            print(f"Manifest {MANIFEST_NAME} mit {len(images)} Bildern veröffentlicht.")
+        return success
+
+
+# -----------------------------------------
+#   HILFSFUNKTION ZUM KONVERTIEREN NACH WEBP
+# -----------------------------------------
+def decode_image_bounded(input_path: str, max_edge: int = None):
+    """
+    Öffnet ein Bild mit begrenztem Speicherbedarf und gibt es geladen zurück.
+
+    Dateien über MAX_IMAGE_BYTES oder mit mehr als MAX_IMAGE_PIXELS Pixeln werden abgelehnt,
+    bevor Pixeldaten dekodiert werden. Ist das Bild größer als max_edge, wird es verkleinert;
+    JPEGs werden dabei per draft() direkt in reduzierter Auflösung (1/2 bis 1/8) dekodiert.
+    """
+    Image = lazy_import("PIL.Image")
+    max_edge = MAX_IMAGE_EDGE if max_edge is None else max_edge
+
+    file_size = os.path.getsize(input_path)
+    if MAX_IMAGE_BYTES and file_size > MAX_IMAGE_BYTES:
+        raise ValueError(f"Datei zu groß ({file_size} Bytes, erlaubt sind {MAX_IMAGE_BYTES}).")
+
+    img = Image.open(input_path)
+    width, height = img.size
+    if MAX_IMAGE_PIXELS and width * height > MAX_IMAGE_PIXELS:
+        img.close()
+        raise ValueError(f"Bild zu groß ({width}x{height} Pixel, erlaubt sind {MAX_IMAGE_PIXELS}).")
+
+    if max_edge and max(width, height) > max_edge:
+        scale = max_edge / max(width, height)
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if img.format == "JPEG":
+            img.draft(img.mode if img.mode in ("RGB", "L") else "RGB", target)
+        # thumbnail() reduziert zuerst mit reduce() in ganzzahligen Schritten und skaliert dann
+        img.thumbnail(target, reducing_gap=2.0)
+    else:
+        img.load()
+    return img
+
+
+def output_formats() -> list:
+    """
+    Liefert OUTPUT_FORMATS. Beim ersten Aufruf werden Formate entfernt, die Pillow hier nicht
+    kodieren kann (z.B. AVIF ohne Pillow >= 11.2 mit libavif), damit /convert nicht jede Datei
+    erfolglos erneut anfasst.
+    """
+    global OUTPUT_FORMATS, output_formats_checked
+    if not output_formats_checked:
+        features = lazy_import("PIL.features")
+        unavailable = [f for f in OUTPUT_FORMATS[1:] if not features.check(f)]
+        for image_format in unavailable:
+            print(f"Ausgabeformat {image_format} wird von Pillow nicht unterstützt und ist deaktiviert.")
+        OUTPUT_FORMATS = [f for f in OUTPUT_FORMATS if f not in unavailable]
+        output_formats_checked = True
+    return OUTPUT_FORMATS
+
+
+def decode_for_encoding(input_path: str):
+    """
+    Dekodiert ein Bild einmal für mehrere Encoder. Das Ergebnis liegt bereits als RGB/RGBA vor,
+    damit die Encoder es parallel lesen können, ohne es selbst umzuwandeln.
+    """
+    img = decode_image_bounded(input_path)
+    if img.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        converted = img.convert("RGBA" if has_alpha else "RGB")
+        img.close()
+        img = converted
+    return img
+
+
+def encode_image(img, image_format: str, output_path: str, copy: bool = False) -> tuple:
+    """
+    Kodiert ein dekodiertes Bild in ein Format. Gibt (Bytes, Sekunden) zurück.
+    Mit copy kodiert der Thread eine eigene Kopie: save() legt seine Optionen am Bild selbst ab
+    (encoderinfo), parallele Encoder auf demselben Bild würden sich diese sonst überschreiben.
+    """
+    started = time.perf_counter()
+    options = {"quality": AVIF_QUALITY} if image_format == "avif" else {}
+    own = img.copy() if copy else img
+    try:
+        own.save(output_path, format=image_format.upper(), **options)
+    finally:
+        if copy:
+            own.close()
+    return os.path.getsize(output_path), time.perf_counter() - started
+
+
+async def convert_image(input_path: str, outputs: dict, executor: ThreadPoolExecutor = None) -> dict:
+    """
+    Dekodiert ein Bild einmal und kodiert es parallel im Encoder-Pool (oder in executor) in alle
+    Formate aus outputs ({Format: Zielpfad}). Gibt {Format: (Bytes, Sekunden)} der erfolgreichen
+    Formate zurück, oder None, wenn das Dekodieren, WebP oder alle Formate fehlschlagen.
+    """
+    try:
+        img = await run_encoder(decode_for_encoding, input_path, executor=executor)
+    except Exception as e:
+        print(f"Fehler beim Dekodieren von {input_path}: {e}")
+        return None
+    try:
+        results = await asyncio.gather(
+            *(
+                run_encoder(encode_image, img, image_format, path, i > 0, executor=executor)
+                for i, (image_format, path) in enumerate(outputs.items())
+            ),
+            return_exceptions=True,
+        )
+    finally:
+        img.close()
+    encoded = {}
+    for image_format, result in zip(outputs, results):
+        if isinstance(result, Exception):
+            print(f"Fehler beim Kodieren nach {image_format.upper()}: {result}")
+        else:
+            encoded[image_format] = result
+    if not encoded or ("webp" in outputs and "webp" not in encoded):
+        return None
+    return encoded
+
+
+def add_to_report(report: dict, encoded: dict):
+    """
+    Summiert Größe und Kodierzeit pro Format für den Bericht am Ende von /convert.
+    """
+    for image_format, (size, seconds) in encoded.items():
+        entry = report.setdefault(image_format, [0, 0, 0.0])
+        entry[0] += 1
+        entry[1] += size
+        entry[2] += seconds
+
+
+def format_report(report: dict) -> str:
+    lines = []
+    webp_size = report.get("webp", [0, 0, 0.0])[1]
+    for image_format, (count, size, seconds) in report.items():
+        line = f"{image_format.upper()}: {count} Dateien, {size / 1e6:.1f} MB, {seconds:.1f} s Kodierzeit"
+        if image_format != "webp" and webp_size and count == report["webp"][0]:
+            line += f" ({(size / webp_size - 1) * 100:+.0f} % ggü. WebP)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def get_encoder_executor() -> ThreadPoolExecutor:
+    """
+    Liefert den Thread-Pool, in dem die Bildkonvertierungen abseits der Event-Loop laufen.
+    """
+    global encoder_executor
+    if encoder_executor is None:
+        encoder_executor = ThreadPoolExecutor(max_workers=ENCODER_WORKERS, thread_name_prefix="encoder")
+    return encoder_executor
+
+
+def get_background_executor() -> ThreadPoolExecutor:
+    """
+    Eigener Thread-Pool für Hintergrundaufgaben (BACKGROUND_CPU_SLOTS Threads), damit deren
+    Konvertierungen nie die Encoder-Threads interaktiver Uploads belegen.
+    """
+    global background_executor
+    if background_executor is None:
+        background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_CPU_SLOTS, thread_name_prefix="background")
+    return background_executor
+
+
+async def run_encoder(func, *args, executor: ThreadPoolExecutor = None):
+    """
+    Führt eine blockierende Konvertierungsfunktion im Encoder-Pool (oder in executor) aus.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or get_encoder_executor(), func, *args)
+
+
+def _warm_encoder(barrier: threading.Barrier = None):
+    """
+    Initialisiert Pillow samt Plugins und kodiert ein winziges Bild, damit die Encoder aller
+    Ausgabeformate geladen sind. Mit barrier wartet der Auftrag, bis alle Worker einen Auftrag
+    haben, sodass jeder Thread des Pools genau einen bekommt (und dabei gestartet wird).
+    """
+    import io
+    if barrier is not None:
+        try:
+            barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+    Image = lazy_import("PIL.Image")
+    Image.init()
+    for image_format in output_formats():
+        Image.new("RGB", (8, 8)).save(io.BytesIO(), format=image_format.upper())
+
+
+# -----------------------------------------
+#   KALTSTART: VORWÄRMEN NACH DEM START
+# -----------------------------------------
+async def _warm_ftp():
+    async with ftp_lock:
+        await ftp_connect()
+
+
+async def prewarm(application):
+    """
+    Wartet, bis der Bot Updates annimmt (Webhook gesetzt bzw. Polling aktiv), und baut dann
+    im Hintergrund die FTP-Verbindung auf und wärmt die Encoder-Threads vor.
+    """
+    while not application.running:
+        await asyncio.sleep(0.1)
+    started = time.perf_counter()
+    try:
+        barrier = threading.Barrier(ENCODER_WORKERS)
+        await asyncio.gather(
+            _warm_ftp(),
+            *(run_encoder(_warm_encoder, barrier) for _ in range(ENCODER_WORKERS)),
+        )
+        start_inactivity_timer()
+        print(f"Vorwärmen abgeschlossen ({(time.perf_counter() - started) * 1000:.0f} ms).")
+    except Exception as e:
+        print(f"Fehler beim Vorwärmen: {e}")
+
+
+async def post_init(application):
+    """
+    post_init-Hook: startet das Vorwärmen als Hintergrund-Task, ohne den Start zu blockieren.
+    """
+    application.bot_data["prewarm_task"] = asyncio.create_task(prewarm(application))
+
+
+# -----------------------------------------
+#   AUSGEHENDE NACHRICHTEN (FLOOD-LIMITS)
+# -----------------------------------------
+class TokenBucket:
+    """
+    Einfacher Token-Bucket: `rate` Nachrichten pro Sekunde, Bursts bis `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """
+        Sperrt den Bucket für die angegebene Zeit (z.B. nach einem RetryAfter von Telegram).
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def wait_time(self) -> float:
+        """
+        Entnimmt ein Token und liefert 0 zurück, oder die Wartezeit bis ein Token verfügbar ist.
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            delay = self.wait_time()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+
+class OutboundScheduler:
+    """
+    Zentrale Warteschlange für Statusmeldungen an Telegram.
+
+    Nachrichten werden pro Chat in Reihenfolge versendet und durch einen globalen und einen
+    Chat-Token-Bucket gedrosselt. RetryAfter-Fehler pausieren den betroffenen Chat und die
+    Nachricht wird erneut versucht. Meldungen mit demselben `coalesce`-Schlüssel werden zu
+    einer einzigen Nachricht zusammengefasst, die bei weiteren Zeilen editiert wird.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, max_length: int = 4000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.max_length = max_length
+        self.chat_buckets = {}
+        self.queues = {}
+        self.workers = {}
+        self.threads = {}
+
+    def enqueue(self, bot, chat_id: int, text: str, coalesce: str = None):
+        """
+        Stellt eine Nachricht in die Warteschlange, ohne auf Telegram zu warten.
+        """
+        if coalesce is not None:
+            thread = self.threads.get((chat_id, coalesce))
+            if thread is not None and len(thread["text"]) + len(text) + 1 <= self.max_length:
+                thread["text"] += "\n" + text
+                if thread["pending"]:
+                    return
+                thread["pending"] = True
+                self._push(bot, chat_id, thread)
+                return
+        thread = {"text": text, "message": None, "pending": True}
+        if coalesce is not None:
+            self.threads[(chat_id, coalesce)] = thread
+        self._push(bot, chat_id, thread)
+
+    def end_thread(self, chat_id: int, coalesce: str):
+        """
+        Schließt eine zusammengefasste Nachricht ab; weitere Zeilen beginnen eine neue Nachricht.
+        """
+        self.threads.pop((chat_id, coalesce), None)
+
+    async def drain(self):
+        """
+        Wartet, bis alle Warteschlangen abgearbeitet sind.
+        """
+        while self.workers:
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
+
+    def _push(self, bot, chat_id: int, thread: dict):
+        self.queues.setdefault(chat_id, collections.deque()).append(thread)
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._work(bot, chat_id))
+
+    async def _work(self, bot, chat_id: int):
+        queue = self.queues[chat_id]
+        bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, 1))
+        try:
+            while queue:
+                thread = queue.popleft()
+                thread["pending"] = False
+                await self._deliver(bot, chat_id, thread, bucket)
+        finally:
+            del self.workers[chat_id]
+            if queue:
+                # Während des Abschlusses neu eingereihte Nachrichten nicht liegen lassen
+                self.workers[chat_id] = asyncio.create_task(self._work(bot, chat_id))
+            else:
+                self.queues.pop(chat_id, None)
+
+    async def _deliver(self, bot, chat_id: int, thread: dict, bucket: TokenBucket):
+        telegram_error = lazy_import("telegram.error")
+        while True:
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                if thread["message"] is None:
+                    thread["message"] = await bot.send_message(chat_id, thread["text"])
+                else:
+                    await thread["message"].edit_text(thread["text"])
+                return
+            except telegram_error.RetryAfter as e:
+                delay = e.retry_after
+                if hasattr(delay, "total_seconds"):
+                    delay = delay.total_seconds()
+                print(f"Flood-Limit für Chat {chat_id}, warte {delay} s.")
+                bucket.pause(delay)
+            except telegram_error.BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    print(f"Fehler beim Senden an Chat {chat_id}: {e}")
+                return
+            except Exception as e:
+                print(f"Fehler beim Senden an Chat {chat_id}: {e}")
+                return
+
+
+def get_outbox() -> OutboundScheduler:
+    """
+    Liefert den globalen OutboundScheduler und legt ihn bei Bedarf an.
+    """
+    global outbox
+    if outbox is None:
+        outbox = OutboundScheduler(TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE)
+    return outbox
+
+
+def notify(context: CallbackContext, chat_id: int, text: str, coalesce: str = None):
+    """
+    Reiht eine nicht-kritische Statusmeldung ein, ohne auf die Telegram-API zu warten.
+    """
+    get_outbox().enqueue(context.bot, chat_id, text, coalesce)
+
+
+async def post_stop(application):
+    """
+    post_stop-Hook: versendet noch ausstehende Statusmeldungen. Läuft vor Application.shutdown(),
+    solange die Request-Objekte des Bots noch initialisiert sind (in post_shutdown wäre es zu spät).
+    """
+    if outbox is not None:
+        await outbox.drain()
+
+
+async def post_shutdown(application):
+    """
+    post_shutdown-Hook: veröffentlicht ein noch entprelltes Manifest und wartet auf eine
+    laufende Veröffentlichung vor dem Beenden.
+    """
+    global manifest_timer
+    if manifest_task is not None and not manifest_task.done():
+        await manifest_task
+    if manifest_timer is not None:
+        manifest_timer.cancel()
+        manifest_timer = None
+        await publish_manifest()
+
+
+# -----------------------------------------
+#   CALLBACK-DATEN UND TASTATUREN
+# -----------------------------------------
+# Aufbau: "<Version>:<Aktion>:<Datei-ID>:<Seite/Wert>:<Nonce>", z.B. "1:s:3f9a0c11d2:0:a1b2".
+# Die Datei-ID ist ein Hash des Dateinamens (kein Listenindex), die Nonce gehört zur aktuellen
+# /list-Sitzung des Nutzers. Buttons aus älteren Sitzungen werden damit sofort abgewiesen.
+CALLBACK_VERSION = "1"
+
+
+class CallbackData(NamedTuple):
+    action: str
+    file_id: str = ""
+    page: int = 0  # Seite der Liste bzw. Zahlenwert der Aktion (z.B. Monat 1–12)
+    nonce: str = ""
+
+
+def encode_callback(action: str, file_id: str = "", page: int = 0, nonce: str = "") -> str:
+    """
+    Kodiert eine Callback-Aktion kompakt (Telegram erlaubt maximal 64 Bytes).
+    """
+    return f"{CALLBACK_VERSION}:{action}:{file_id}:{page}:{nonce}"
+
+
+def decode_callback(data: str):
+    """
+    Dekodiert Callback-Daten. Gibt None zurück, wenn Format oder Version nicht passen.
+    """
+    parts = data.split(":")
+    if len(parts) != 5 or parts[0] != CALLBACK_VERSION or not parts[3].isdigit():
+        return None
+    return CallbackData(parts[1], parts[2], int(parts[3]), parts[4])
+
+
+def file_key(file_name: str) -> str:
+    """
+    Liefert eine kurze, stabile ID für einen Dateinamen.
+    """
+    return hashlib.blake2s(file_name.encode(), digest_size=5).hexdigest()
+
+
+def session_nonce(context: CallbackContext) -> str:
+    """
+    Liefert die Nonce der aktuellen Sitzung und legt bei Bedarf eine neue an.
+    """
+    if "nonce" not in context.user_data:
+        context.user_data["nonce"] = secrets.token_hex(2)
+    return context.user_data["nonce"]
+
+
+def register_files(context: CallbackContext, files: list):
+    """
+    Merkt sich die aufgelisteten Dateien samt ihrer IDs für die Callback-Auflösung.
+    """
+    context.user_data["files"] = files
+    context.user_data["file_ids"] = {file_key(f): f for f in files}
+
+
+def selected_file(context: CallbackContext):
+    """
+    Liefert den Dateinamen des aktuell ausgewählten Bildes oder None.
+    """
+    return context.user_data.get("file_ids", {}).get(context.user_data.get("selected_file_id"))
+
+
+def replace_selected_file(context: CallbackContext, new_name: str):
+    """
+    Ersetzt nach einer Umbenennung das ausgewählte Bild in Liste und ID-Tabelle.
+    """
+    old_name = selected_file(context)
+    files = context.user_data.get("files", [])
+    if old_name in files:
+        files[files.index(old_name)] = new_name
+    file_ids = context.user_data.setdefault("file_ids", {})
+    file_ids.pop(context.user_data.get("selected_file_id"), None)
+    new_id = file_key(new_name)
+    file_ids[new_id] = new_name
+    context.user_data["selected_file_id"] = new_id
+
+
+def list_keyboard(files: list, page: int, nonce: str, selection: set = None):
+    """
+    Baut die Tastatur für eine Seite der Bilderliste inklusive Blättern.
+    Ist `selection` gesetzt, läuft die Liste im Mehrfachauswahl-Modus mit Sammelaktionen.
+    """
+    telegram = lazy_import("telegram")
+    InlineKeyboardButton, InlineKeyboardMarkup = telegram.InlineKeyboardButton, telegram.InlineKeyboardMarkup
+    start_index = page * LIST_PAGE_SIZE
+    page_files = files[start_index:start_index + LIST_PAGE_SIZE]
+    keyboard = []
+    for i, f in enumerate(page_files):
+        title = f.split("_")[0].replace("-", " ")
+        key = file_key(f)
+        if selection is None:
+            label, action = f"{start_index + i + 1}. {title}", "s"
+        else:
+            mark = "✅" if key in selection else "⬜"
+            label, action = f"{mark} {start_index + i + 1}. {title}", "b"
+        keyboard.append([InlineKeyboardButton(label, callback_data=encode_callback(action, key, page, nonce))])
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=encode_callback("p", "", page - 1, nonce)))
+    if start_index + LIST_PAGE_SIZE < len(files):
+        navigation.append(InlineKeyboardButton("▶️", callback_data=encode_callback("p", "", page + 1, nonce)))
+    if navigation:
+        keyboard.append(navigation)
+    if selection is None:
+        keyboard.append([
+            InlineKeyboardButton("☑️ Mehrfachauswahl", callback_data=encode_callback("B", "", page, nonce))
+        ])
+    else:
+        keyboard.extend(bulk_actions_keyboard(page, nonce, len(selection)))
+    return InlineKeyboardMarkup(keyboard)
+
+
+@functools.lru_cache(maxsize=256)
+def bulk_actions_keyboard(page: int, nonce: str, count: int) -> tuple:
+    """
+    Zeilen mit den Sammelaktionen für den Mehrfachauswahl-Modus.
+    """
+    InlineKeyboardButton = lazy_import("telegram").InlineKeyboardButton
+    return (
+        (
+            InlineKeyboardButton(f"Verfügbar ({count})", callback_data=encode_callback("A", "", page, nonce)),
+            InlineKeyboardButton(f"Nicht verfügbar ({count})", callback_data=encode_callback("U", "", page, nonce)),
+        ),
+        (
+            InlineKeyboardButton("Material ändern", callback_data=encode_callback("N", "", page, nonce)),
+            InlineKeyboardButton("Jahr ändern", callback_data=encode_callback("Y", "", page, nonce)),
+        ),
+        (
+            InlineKeyboardButton(f"🗑 Löschen ({count})", callback_data=encode_callback("D", "", page, nonce)),
+            InlineKeyboardButton("✖️ Beenden", callback_data=encode_callback("X", "", page, nonce)),
+        ),
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def options_keyboard(file_id: str, nonce: str):
+    """
+    Bearbeitungsmenü für ein Bild (einmal pro Bild und Sitzung gebaut).
+    """
+    telegram = lazy_import("telegram")
+    InlineKeyboardButton, InlineKeyboardMarkup = telegram.InlineKeyboardButton, telegram.InlineKeyboardMarkup
+    options = [
+        ("1. Titel ändern", "t"),
+        ("2. Material ändern", "m"),
+        ("3. Datum ändern", "d"),
+        ("4. Maße ändern", "w"),
+        ("5. Verfügbarkeit ändern", "v"),
+        ("6. Löschen", "x"),
+        ("7. Startbild festlegen", "S"),
+        ("8. Fertig", "f"),
+    ]
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(label, callback_data=encode_callback(action, file_id, 0, nonce))]
+         for label, action in options]
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def availability_keyboard(file_id: str, nonce: str):
+    """
+    Auswahl der Verfügbarkeit für ein Bild.
+    """
+    telegram = lazy_import("telegram")
+    InlineKeyboardButton, InlineKeyboardMarkup = telegram.InlineKeyboardButton, telegram.InlineKeyboardMarkup
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Verfügbar", callback_data=encode_callback("a", file_id, 0, nonce))],
+        [InlineKeyboardButton("Nicht verfügbar", callback_data=encode_callback("u", file_id, 0, nonce))],
+    ])
+
+
+@functools.lru_cache(maxsize=64)
+def month_keyboard(nonce: str):
+    """
+    Monatsauswahl für Upload und Datumsänderung (Wert 0 = kein Monat).
+    """
+    telegram = lazy_import("telegram")
+    InlineKeyboardButton, InlineKeyboardMarkup = telegram.InlineKeyboardButton, telegram.InlineKeyboardMarkup
+    keyboard = [[InlineKeyboardButton("Kein Monat angeben", callback_data=encode_callback("M", "", 0, nonce))]]
+    for row_start in range(0, 12, 3):
+        keyboard.append([
+            InlineKeyboardButton(MONTHS[i], callback_data=encode_callback("M", "", i + 1, nonce))
+            for i in range(row_start, row_start + 3)
+        ])
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def dispatch_callback(update: Update, context: CallbackContext):
+    """
+    Einziger CallbackQueryHandler: dekodiert die Daten, weist veraltete Buttons ab und
+    leitet per Tabellen-Lookup an die passende Aktion weiter.
+    """
+    query = update.callback_query
+    payload = decode_callback(query.data or "")
+    handler = CALLBACK_ACTIONS.get(payload.action) if payload else None
+    if handler is None or payload.nonce != context.user_data.get("nonce"):
+        await query.answer("⚠️ Dieser Button ist abgelaufen. Bitte /list erneut aufrufen.")
+        return
+    if payload.file_id:
+        if payload.file_id not in context.user_data.get("file_ids", {}):
+            await query.answer("⚠️ Dieses Bild ist nicht mehr in der Liste. Bitte /list erneut aufrufen.")
+            return
+        context.user_data["selected_file_id"] = payload.file_id
+    await handler(update, context, payload)
+
+
+# -----------------------------------------
+#   VORSCHAUBILDER FÜR /list
+# -----------------------------------------
+def make_thumbnail(input_path: str) -> bytes:
+    """
+    Erzeugt ein kleines JPEG-Vorschaubild (längste Kante THUMBNAIL_EDGE).
+    """
+    import io
+    with decode_image_bounded(input_path, THUMBNAIL_EDGE) as img:
+        buffer = io.BytesIO()
+        img.convert("RGB").save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def invalidate_thumbnail(file_name: str):
+    """
+    Entfernt die zwischengespeicherte Telegram-file_id eines Bildes (nach Umbenennen,
+    Löschen oder erneutem Hochladen).
+    """
+    thumbnail_cache.pop(file_name, None)
 
 
-# -----------------------------------------
-#   HILFSFUNKTION ZUM KONVERTIEREN NACH WEBP
-# -----------------------------------------
-def convert_image_to_webp(input_path: str, output_path: str):
+async def send_list_preview(context: CallbackContext, chat_id: int, files: list, page: int):
     """
-    Konvertiert eine Bilddatei mithilfe von Pillow ins WebP-Format.
+    Sendet die Vorschaubilder einer Listenseite als Mediengruppe.
+
+    Bereits gesendete Vorschauen werden per Telegram-file_id erneut verschickt (Schlüssel:
+    Dateiname und Größe). Nur fehlende werden vom FTP geladen, verkleinert und hochgeladen.
     """
-    try:
-        with Image.open(input_path) as img:
-            # Optional kann man hier Quality oder andere Parameter setzen:
-            img.save(output_path, format="WEBP")
-        return True
-    except Exception as e:
-        print(f"Fehler beim Konvertieren nach WebP: {e}")
-        return False
+    InputMediaPhoto = lazy_import("telegram").InputMediaPhoto
+    start_index = page * LIST_PAGE_SIZE
+    page_files = files[start_index:start_index + LIST_PAGE_SIZE]
+    sizes = gallery_entries or {}
+
+    missing = [
+        name for name in page_files
+        if name not in thumbnail_cache or thumbnail_cache[name][0] != sizes.get(name)
+    ]
+    # file_ids jetzt festhalten: parallele Umbenennungen können den Cache währenddessen leeren
+    thumbnails = {name: thumbnail_cache[name][1] for name in page_files if name not in missing}
+    if missing:
+        local_paths = {
+            name: os.path.join(LOCAL_DOWNLOAD_PATH, f"thumb_{file_key(name)}{os.path.splitext(name)[1]}")
+            for name in missing
+        }
+        results = await run_ftp_batch([(download_from_ftp, name, local_paths[name]) for name in missing])
+        for name, success in zip(missing, results):
+            local_path = local_paths[name]
+            if success:
+                try:
+                    thumbnails[name] = await run_encoder(make_thumbnail, local_path)
+                except Exception as e:
+                    print(f"Fehler beim Erzeugen der Vorschau für {name}: {e}")
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+    # Telegram erlaubt höchstens 10 Medien pro Gruppe
+    entries = [
+        (start_index + i + 1, name) for i, name in enumerate(page_files)
+        if name in thumbnails
+    ]
+    for chunk_start in range(0, len(entries), 10):
+        chunk = entries[chunk_start:chunk_start + 10]
+        media = [
+            InputMediaPhoto(
+                thumbnails[name],
+                caption=f"{number}. {name.split('_')[0].replace('-', ' ')}",
+            )
+            for number, name in chunk
+        ]
+        try:
+            if len(media) == 1:
+                messages = [await context.bot.send_photo(chat_id, media[0].media, caption=media[0].caption)]
+            else:
+                messages = await context.bot.send_media_group(chat_id, media)
+        except Exception as e:
+            print(f"Fehler beim Senden der Vorschau: {e}")
+            continue
+        for (number, name), message in zip(chunk, messages):
+            if message.photo:
+                thumbnail_cache[name] = (sizes.get(name), message.photo[-1].file_id)
 
 
 # -----------------------------------------
@@ -179,7 +1336,8 @@ def convert_image_to_webp(input_path: str, output_path: str):
 # -----------------------------------------
 async def start(update: Update, context: CallbackContext):
     # FTP-Verbindung aufbauen, Timer starten
-    await ftp_connect()
+    async with ftp_lock:
+        await ftp_connect()
     start_inactivity_timer()
     await update.message.reply_text(
         "Hallo! Sende mir ein Bild, um es hochzuladen. "
@@ -188,14 +1346,20 @@ async def start(update: Update, context: CallbackContext):
     )
 
 
-async def discard_changes(update: Update, context: CallbackContext):
+async def discard_changes(update: Update, context: CallbackContext, payload: CallbackData):
     """
-    Schließt die Bearbeitung ab, entfernt Inline-Keyboard und setzt Kontext zurück.
+    Schließt die Bearbeitung ab: übernimmt vorgemerkte Änderungen, entfernt Inline-Keyboard
+    und setzt Kontext zurück. Ergebnis und Abschlusszeile landen in derselben Nachricht.
     """
-    await update.callback_query.edit_message_reply_markup(reply_markup=None)
+    query = update.callback_query
+    chat_id = query.message.chat.id
+    # Sofort beantworten, damit der Button nicht während der FTP-Umbenennungen hängt
+    await query.answer()
+    await query.edit_message_reply_markup(reply_markup=None)
+    await commit_staged_changes(context, chat_id)
     context.user_data.clear()
-    await update.callback_query.answer("Bearbeitungsaktion wurde abgeschlossen.")
-    await update.callback_query.message.reply_text("Bearbeitungsaktion wurde abgeschlossen.")
+    notify(context, chat_id, "Bearbeitungsaktion wurde abgeschlossen.", coalesce="commit")
+    get_outbox().end_thread(chat_id, "commit")
 
 
 async def help_command(update: Update, context: CallbackContext):
@@ -204,7 +1368,8 @@ async def help_command(update: Update, context: CallbackContext):
         "/start - Startet den Bot\n"
         "/help - Zeigt diese Hilfe an\n"
         "/list - Listet alle Bilder auf dem FTP auf\n"
-        "/convert - Konvertiert alle Bilder auf dem FTP in WebP\n"
+        "/convert - Konvertiert alle Bilder auf dem FTP in WebP (/convert später: im Ruhefenster)\n"
+        "/migrate - Verschiebt alle Bilder in die konfigurierte Ablagestruktur\n"
     )
 
 
@@ -217,173 +1382,109 @@ async def list_images(update: Update, context: CallbackContext):
         await update.message.reply_text("📂 Keine Bilder gefunden.")
         return
 
-    # Nur den Titel also alles bis zum ersten _ und alle - mit " " ersetzen
-    titles = [f.split("_")[0].replace("-", " ") for f in files]
-    keyboard = [
-        [InlineKeyboardButton(f"{i+1}. {titles[i]}", callback_data=f"select_{i}")]
-        for i in range(len(files))
-    ]
-
-    context.user_data["files"] = files
+    # Neue Sitzung: Buttons aus früheren Listen werden damit ungültig
+    context.user_data["nonce"] = secrets.token_hex(2)
+    context.user_data.pop("bulk_selection", None)
+    context.user_data.pop("bulk_message", None)
+    context.user_data.pop("staged", None)
+    register_files(context, files)
+    if LIST_PREVIEWS:
+        await send_list_preview(context, update.effective_chat.id, files, 0)
     await update.message.reply_text(
         "📂 Verfügbare Bilder:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=list_keyboard(files, 0, context.user_data["nonce"])
     )
 
 
-async def show_image_options(update: Update, context: CallbackContext):
+async def show_list_page(update: Update, context: CallbackContext, payload: CallbackData):
     """
-    Zeigt das Bearbeitungsmenü für ein ausgewähltes Bild.
+    Blättert in der Bilderliste.
     """
-    await update.callback_query.message.edit_reply_markup(reply_markup=None)
     query = update.callback_query
-    index = int(query.data.split("_")[1])
-    context.user_data["selected_image_index"] = index
-
-    keyboard = [
-        [InlineKeyboardButton("1. Titel ändern", callback_data="edit_title")],
-        [InlineKeyboardButton("2. Material ändern", callback_data="edit_material")],
-        [InlineKeyboardButton("3. Datum ändern", callback_data="edit_date")],
-        [InlineKeyboardButton("4. Maße ändern", callback_data="edit_dimensions")],
-        [InlineKeyboardButton("5. Verfügbarkeit ändern", callback_data="edit_availability")],
-        [InlineKeyboardButton("6. Löschen", callback_data="delete")],
-        [InlineKeyboardButton("7. Startbild festlegen", callback_data="set_start_image")],
-        [InlineKeyboardButton("8. Fertig", callback_data="discard_changes")]
-    ]
+    await query.answer()
+    files = context.user_data.get("files", [])
+    selection = context.user_data.get("bulk_selection")
+    await query.edit_message_reply_markup(reply_markup=list_keyboard(files, payload.page, payload.nonce, selection))
+    if selection is not None:
+        # Nach Sammelaktion/Beenden wird die Seite neu gezeichnet, auf der der Admin gerade ist
+        context.user_data["bulk_message"] = (query.message.chat.id, query.message.message_id, payload.page)
+    if LIST_PREVIEWS:
+        await send_list_preview(context, query.message.chat.id, files, payload.page)
+
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def show_image_options(update: Update, context: CallbackContext, payload: CallbackData):
+    """
+    Zeigt das Bearbeitungsmenü für ein ausgewähltes Bild.
+    """
+    await update.callback_query.message.edit_reply_markup(reply_markup=None)
     await update.callback_query.message.reply_text(
         "Bitte wähle eine Bearbeitungsoption:",
-        reply_markup=reply_markup
+        reply_markup=options_keyboard(payload.file_id, payload.nonce)
     )
 
 
 # -----------------------------------------
 #   BEARBEITUNGSAKTIONEN
 # -----------------------------------------
-async def change_title(update: Update, context: CallbackContext):
+async def change_title(update: Update, context: CallbackContext, payload: CallbackData):
     query = update.callback_query
     await query.answer()
     context.user_data["edit_action"] = "change_title"
     await query.edit_message_text("Bitte sende den neuen Titel für das Bild (keine Bindestriche oder Unterstriche):")
 
 
-async def change_material(update: Update, context: CallbackContext):
+async def change_material(update: Update, context: CallbackContext, payload: CallbackData):
     query = update.callback_query
     await query.answer()
     context.user_data["edit_action"] = "change_material"
     await query.edit_message_text("Bitte sende das neue Material für das Bild (nur Buchstaben, keine Bindestriche/Unterstriche):")
 
 
-async def change_date(update: Update, context: CallbackContext):
+async def change_date(update: Update, context: CallbackContext, payload: CallbackData):
     """
     Startet den Prozess des Datumswechsels (Monat + Jahr).
     """
     query = update.callback_query
     await query.answer()
     context.user_data["edit_action"] = "change_date"
-
-    # Inline-Keyboard zur Monatseingabe
-    keyboard = [
-        [InlineKeyboardButton("Kein Monat angeben", callback_data="none")],
-        [
-            InlineKeyboardButton("Januar", callback_data="Januar"),
-            InlineKeyboardButton("Februar", callback_data="Februar"),
-            InlineKeyboardButton("März", callback_data="März"),
-        ],
-        [
-            InlineKeyboardButton("April", callback_data="April"),
-            InlineKeyboardButton("Mai", callback_data="Mai"),
-            InlineKeyboardButton("Juni", callback_data="Juni"),
-        ],
-        [
-            InlineKeyboardButton("Juli", callback_data="Juli"),
-            InlineKeyboardButton("August", callback_data="August"),
-            InlineKeyboardButton("September", callback_data="September"),
-        ],
-        [
-            InlineKeyboardButton("Oktober", callback_data="Oktober"),
-            InlineKeyboardButton("November", callback_data="November"),
-            InlineKeyboardButton("Dezember", callback_data="Dezember"),
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("Bitte wähle den Monat aus:", reply_markup=reply_markup)
+    await query.edit_message_text("Bitte wähle den Monat aus:", reply_markup=month_keyboard(payload.nonce))
 
 
-async def change_availability(update: Update, context: CallbackContext):
+async def change_availability(update: Update, context: CallbackContext, payload: CallbackData):
     """
     Ändert die Verfügbarkeit eines Bildes (Suffix _x).
     """
     query = update.callback_query
     await query.answer()
     context.user_data["edit_action"] = "change_availability"
-    keyboard = [
-        [InlineKeyboardButton("Verfügbar", callback_data="set_available")],
-        [InlineKeyboardButton("Nicht verfügbar", callback_data="set_unavailable")]
-    ]
     await query.edit_message_text(
         "Bitte wähle die Verfügbarkeit aus:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=availability_keyboard(payload.file_id, payload.nonce)
     )
 
 
-async def set_availability(update: Update, context: CallbackContext):
+async def set_availability(update: Update, context: CallbackContext, payload: CallbackData):
     """
     Setzt Verfügbarkeit (_x = nicht verfügbar) oder entfernt das Suffix.
     """
     query = update.callback_query
-    availability_status = query.data
-    files = context.user_data.get("files", [])
-    selected_image_index = context.user_data.get("selected_image_index")
-    selected_image_name = files[selected_image_index]
-
-    # Endung abtrennen
-    if "." in selected_image_name:
-        name_part, file_extension = selected_image_name.rsplit(".", 1)
-    else:
-        name_part = selected_image_name
-        file_extension = ""
-
-    rename_needed = False
-
-    if availability_status == "set_available":
-        # Entferne _x
-        if name_part.endswith("_x"):
-            name_part = name_part[:-2]
-            rename_needed = True
-        elif name_part.endswith("_x_S"):
-            name_part = name_part[:-4] + "_S"
-            rename_needed = True
-    elif availability_status == "set_unavailable":
-        # Füge _x hinzu
-        if not name_part.endswith("_x") and not name_part.endswith("_x_S"):
-            if name_part.endswith("_S"):
-                name_part = name_part[:-2] + "_x_S"
-            else:
-                name_part += "_x"
-            rename_needed = True
-
-    if rename_needed:
-        new_name = f"{name_part}.{file_extension}" if file_extension else name_part
-        if await rename_ftp_file(selected_image_name, new_name):
-            await query.edit_message_text(f"Verfügbarkeit erfolgreich geändert: {new_name}.")
-        else:
-            await query.edit_message_text("❌ Fehler bei der Durchführung der Aktion.")
-    else:
-        await query.edit_message_text("Keine Änderung erforderlich. Dateiname bleibt unverändert.")
-
+    await query.answer()
+    staged_meta(context)["available"] = payload.action == "a"
     context.user_data["edit_action"] = None  # Aktion abschließen
+    await query.edit_message_text(
+        staged_preview_text(context),
+        reply_markup=options_keyboard(payload.file_id, payload.nonce),
+    )
 
 
-async def change_dimensions(update: Update, context: CallbackContext):
+async def change_dimensions(update: Update, context: CallbackContext, payload: CallbackData):
     query = update.callback_query
     await query.answer()
     context.user_data["edit_action"] = "change_dimensions"
     await query.edit_message_text("Bitte sende die neuen Maße im Format 'Breite x Höhe':")
 
 
-async def set_start_image(update: Update, context: CallbackContext):
+async def set_start_image(update: Update, context: CallbackContext, payload: CallbackData):
     """
     Setzt für ein Bild das Suffix _S als "Startbild" und entfernt es für andere.
     """
@@ -391,11 +1492,12 @@ async def set_start_image(update: Update, context: CallbackContext):
     await query.answer()
     context.user_data["edit_action"] = "set_start_image"
     await query.edit_message_text(
-        "Möchtest du dieses Bild als Startbild festlegen? Bestätige mit /confirm oder brich ab mit /cancel."
+        "Möchtest du dieses Bild als Startbild festlegen? Bestätige mit /confirm oder brich ab mit /cancel. "
+        "Die Änderung wird mit „Fertig“ übernommen."
     )
 
 
-async def delete_image(update: Update, context: CallbackContext):
+async def delete_image(update: Update, context: CallbackContext, payload: CallbackData):
     """
     Löscht das ausgewählte Bild (per /confirm bestätigen).
     """
@@ -409,7 +1511,7 @@ async def delete_image(update: Update, context: CallbackContext):
 
 async def confirm(update: Update, context: CallbackContext):
     """
-    Bestätigt Löschaktion oder Setzen des Startbildes.
+    Bestätigt Löschaktion oder merkt das Setzen des Startbildes vor.
     """
     chat_id = update.message.chat.id
     edit_action = context.user_data.get("edit_action")
@@ -417,47 +1519,207 @@ async def confirm(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ Keine Aktion zur Bestätigung gefunden.")
         return
 
-    selected_image_index = context.user_data.get("selected_image_index")
+    if edit_action == "bulk_delete":
+        await run_bulk_operation(context, chat_id, "delete")
+        return
+
     files = context.user_data.get("files", [])
-    selected_image_name = files[selected_image_index]
+    selected_image_name = selected_file(context)
+    if selected_image_name is None:
+        await update.message.reply_text("❌ Kein gültiges Bild ausgewählt.")
+        return
 
     if edit_action == "delete":
         if await delete_ftp_file(selected_image_name):
-            await update.message.reply_text(f"✅ Bild {selected_image_name} wurde erfolgreich gelöscht.")
+            files.remove(selected_image_name)
+            register_files(context, files)
+            notify(context, chat_id, f"✅ Bild {selected_image_name} wurde erfolgreich gelöscht.")
         else:
-            await update.message.reply_text(f"❌ Fehler beim Löschen des Bildes {selected_image_name}.")
+            notify(context, chat_id, f"❌ Fehler beim Löschen des Bildes {selected_image_name}.")
 
     elif edit_action == "set_start_image":
-        # Entferne _S von allen anderen Bildern
-        for i, file in enumerate(files):
-            if file.endswith("_S.png") or file.endswith("_S.jpg") or file.endswith("_S.webp"):
-                new_file_name = file.replace("_S", "")
-                await rename_ftp_file(file, new_file_name)
-        # Füge beim ausgewählten Bild _S hinzu
-        parts = selected_image_name.rsplit(".", maxsplit=1)
-        if len(parts) == 2:
-            name, extension = parts
-            if "_x." in name or "_x_" in name:
-                name = name.replace("_x", "_x_S")  # Falls bereits _x existiert
-            else:
-                name += "_S"
-            new_name = f"{name}.{extension}"
-            if await rename_ftp_file(selected_image_name, new_name):
-                await update.message.reply_text(f"✅ Bild {new_name} wurde erfolgreich als Startbild festgelegt.")
-            else:
-                await update.message.reply_text("❌ Fehler beim Festlegen des Startbildes.")
-        else:
-            await update.message.reply_text("❌ Fehler beim Verarbeiten des Dateinamens.")
+        # Wird zusammen mit den übrigen Änderungen mit „Fertig“ übernommen
+        staged_meta(context)["start"] = True
+        await update.message.reply_text(
+            staged_preview_text(context),
+            reply_markup=options_keyboard(context.user_data["selected_file_id"], session_nonce(context)),
+        )
 
     context.user_data["edit_action"] = None  # Aktion abschließen
 
 
 async def cancel(update: Update, context: CallbackContext):
     """
-    Bricht eine Aktion ab.
+    Bricht eine Aktion ab. Wartet eine Rückfrage oder Eingabe (edit_action), wird nur diese
+    abgebrochen und vorgemerkte Änderungen bleiben erhalten; sonst werden diese verworfen.
     """
     context.user_data[update.message.chat.id] = None
-    await update.message.reply_text("❌ Aktion abgebrochen.")
+    if context.user_data.get("edit_action"):
+        context.user_data["edit_action"] = None
+        if context.user_data.get("staged"):
+            await update.message.reply_text(
+                "❌ Aktion abgebrochen. Vorgemerkte Änderungen bleiben erhalten "
+                "(mit „Fertig“ übernehmen, erneutes /cancel verwirft sie)."
+            )
+        else:
+            await update.message.reply_text("❌ Aktion abgebrochen.")
+    elif context.user_data.pop("staged", None):
+        await update.message.reply_text("❌ Vorgemerkte Änderungen wurden verworfen.")
+    else:
+        await update.message.reply_text("❌ Aktion abgebrochen.")
+
+
+# -----------------------------------------
+#   MEHRFACHAUSWAHL UND SAMMELAKTIONEN
+# -----------------------------------------
+async def start_bulk_selection(update: Update, context: CallbackContext, payload: CallbackData):
+    """
+    Schaltet die Liste in den Mehrfachauswahl-Modus.
+    """
+    query = update.callback_query
+    await query.answer()
+    context.user_data["bulk_selection"] = set()
+    context.user_data["bulk_message"] = (query.message.chat.id, query.message.message_id, payload.page)
+    files = context.user_data.get("files", [])
+    await query.edit_message_reply_markup(reply_markup=list_keyboard(files, payload.page, payload.nonce, set()))
+
+
+async def toggle_bulk_selection(update: Update, context: CallbackContext, payload: CallbackData):
+    """
+    Wählt ein Bild in der Mehrfachauswahl an oder ab.
+    """
+    query = update.callback_query
+    await query.answer()
+    selection = context.user_data.setdefault("bulk_selection", set())
+    selection ^= {payload.file_id}
+    context.user_data["bulk_message"] = (query.message.chat.id, query.message.message_id, payload.page)
+    files = context.user_data.get("files", [])
+    await query.edit_message_reply_markup(reply_markup=list_keyboard(files, payload.page, payload.nonce, selection))
+
+
+async def bulk_action(update: Update, context: CallbackContext, payload: CallbackData):
+    """
+    Startet eine Sammelaktion für die ausgewählten Bilder.
+    Verfügbarkeit wird sofort gesetzt, Material/Jahr erfragen eine Eingabe, Löschen eine Bestätigung.
+    """
+    query = update.callback_query
+    selection = context.user_data.get("bulk_selection") or set()
+    if payload.action == "X":
+        await query.answer()
+        await end_bulk_selection(context)
+        return
+    if not selection:
+        await query.answer("Bitte zuerst mindestens ein Bild auswählen.")
+        return
+    await query.answer()
+    chat_id = query.message.chat.id
+
+    if payload.action in ("A", "U"):
+        await run_bulk_operation(context, chat_id, "available" if payload.action == "A" else "unavailable")
+    elif payload.action == "N":
+        context.user_data["edit_action"] = "bulk_material"
+        await query.message.reply_text(
+            f"Bitte sende das neue Material für {len(selection)} Bilder (nur Buchstaben, keine Bindestriche/Unterstriche):"
+        )
+    elif payload.action == "Y":
+        context.user_data["edit_action"] = "bulk_year"
+        await query.message.reply_text(f"Bitte sende das neue Jahr für {len(selection)} Bilder (z.B. 2024):")
+    elif payload.action == "D":
+        context.user_data["edit_action"] = "bulk_delete"
+        await query.message.reply_text(
+            f"Möchtest du {len(selection)} Bilder wirklich löschen? Bestätige mit /confirm oder brich ab mit /cancel."
+        )
+
+
+async def end_bulk_selection(context: CallbackContext):
+    """
+    Verlässt den Mehrfachauswahl-Modus und zeigt die Liste wieder normal an.
+    """
+    context.user_data.pop("bulk_selection", None)
+    bulk_message = context.user_data.pop("bulk_message", None)
+    if bulk_message is None:
+        return
+    chat_id, message_id, page = bulk_message
+    files = context.user_data.get("files", [])
+    page = min(page, max(0, (len(files) - 1) // LIST_PAGE_SIZE))
+    try:
+        await context.bot.edit_message_reply_markup(
+            chat_id, message_id, reply_markup=list_keyboard(files, page, session_nonce(context))
+        )
+    except Exception as e:
+        print(f"Fehler beim Aktualisieren der Liste: {e}")
+
+
+def replace_year(date: str, year: str) -> str:
+    """
+    Ersetzt das Jahr in einer Datumsangabe und behält einen vorhandenen Monat bei.
+    """
+    match = DATE_PATTERN.match(date) if date else None
+    month = (match.group(1) or match.group(3)) if match else None
+    return f"{month}-{year}" if month else year
+
+
+async def run_bulk_operation(context: CallbackContext, chat_id: int, kind: str, value: str = None):
+    """
+    Plant eine Sammelaktion (Umbenennen bzw. Löschen), prüft Namenskollisionen, führt sie mit
+    begrenzt parallelen FTP-Verbindungen aus und meldet das Ergebnis in einer Nachricht.
+    """
+    files = context.user_data.get("files", [])
+    file_ids = context.user_data.get("file_ids", {})
+    selected = [file_ids[key] for key in context.user_data.get("bulk_selection", ()) if key in file_ids]
+    context.user_data["edit_action"] = None
+
+    if kind == "delete":
+        plan = [(name, None) for name in selected]
+        results = await run_ftp_batch([(delete_ftp_file, name) for name in selected])
+        skipped = []
+        unchanged = 0
+    else:
+        taken = set(files)
+        plan, skipped = [], []
+        unchanged = 0
+        for name in selected:
+            meta = parse_filename(name)
+            if kind == "available":
+                meta["available"] = True
+            elif kind == "unavailable":
+                meta["available"] = False
+            elif kind == "material":
+                meta["material"] = value
+            elif kind == "year":
+                meta["date"] = replace_year(meta["date"], value)
+            new_name = build_filename(meta)
+            if new_name == name:
+                unchanged += 1
+            elif new_name in taken:
+                skipped.append(f"{name} → {new_name} existiert bereits")
+            else:
+                taken.add(new_name)
+                plan.append((name, new_name))
+        results = await run_ftp_batch([(rename_ftp_file, old, new) for old, new in plan])
+
+    failed = []
+    for (old_name, new_name), success in zip(plan, results):
+        if not success:
+            failed.append(old_name)
+        elif new_name is None:
+            files.remove(old_name)
+        else:
+            files[files.index(old_name)] = new_name
+    register_files(context, files)
+
+    done = len(plan) - len(failed)
+    lines = [f"✅ {done} Bilder {'gelöscht' if kind == 'delete' else 'geändert'}."]
+    if unchanged:
+        lines.append(f"{unchanged} Bilder waren bereits aktuell.")
+    if skipped:
+        lines.append(f"⚠️ {len(skipped)} übersprungen:")
+        lines.extend(skipped)
+    if failed:
+        lines.append(f"❌ {len(failed)} fehlgeschlagen:")
+        lines.extend(failed)
+    notify(context, chat_id, "\n".join(lines))
+    await end_bulk_selection(context)
 
 
 # -----------------------------------------
@@ -481,6 +1743,9 @@ async def receive_photo(update: Update, context: CallbackContext):
 
     # Start der Dialog-Schritte
     context.user_data["photo_upload"] = True
+    # Ein abgebrochener vorheriger Dialog gibt sein Foto für die Wartung frei
+    active_uploads.discard(os.path.abspath(context.user_data.get("current_photo_path") or ""))
+    active_uploads.add(os.path.abspath(local_path))
     context.user_data["current_photo_path"] = local_path
     context.user_data["current_file_extension"] = original_file_extension
     context.user_data["upload_step"] = "title"  # Erster Schritt: Titel
@@ -523,30 +1788,7 @@ async def photo_upload_dialog(update: Update, context: CallbackContext):
             return
         context.user_data["material"] = material
         # Inline-Keyboard für Monat
-        keyboard = [
-            [InlineKeyboardButton("Kein Monat angeben", callback_data="none")],
-            [
-                InlineKeyboardButton("Januar", callback_data="Januar"),
-                InlineKeyboardButton("Februar", callback_data="Februar"),
-                InlineKeyboardButton("März", callback_data="März"),
-            ],
-            [
-                InlineKeyboardButton("April", callback_data="April"),
-                InlineKeyboardButton("Mai", callback_data="Mai"),
-                InlineKeyboardButton("Juni", callback_data="Juni"),
-            ],
-            [
-                InlineKeyboardButton("Juli", callback_data="Juli"),
-                InlineKeyboardButton("August", callback_data="August"),
-                InlineKeyboardButton("September", callback_data="September"),
-            ],
-            [
-                InlineKeyboardButton("Oktober", callback_data="Oktober"),
-                InlineKeyboardButton("November", callback_data="November"),
-                InlineKeyboardButton("Dezember", callback_data="Dezember"),
-            ],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = month_keyboard(session_nonce(context))
         context.user_data["upload_step"] = "choose_month"
         await update.message.reply_text("Bitte wähle den Monat aus:", reply_markup=reply_markup)
 
@@ -585,7 +1827,7 @@ async def photo_upload_dialog(update: Update, context: CallbackContext):
 
 async def upload_photo(update: Update, context: CallbackContext):
     """
-    Führt die tatsächliche Umwandlung nach WebP und den Upload zum FTP durch.
+    Führt die tatsächliche Umwandlung nach WebP (und ggf. weitere OUTPUT_FORMATS) und den Upload zum FTP durch.
     """
     local_path = context.user_data.get("current_photo_path")
     original_extension = context.user_data.get("current_file_extension", ".jpg")
@@ -613,39 +1855,42 @@ async def upload_photo(update: Update, context: CallbackContext):
     # final .webp
     filename += ".webp"
 
-    # Lokaler Name, den wir hochladen wollen (nach Konvertierung):
-    new_local_path = os.path.join(LOCAL_DOWNLOAD_PATH, filename)
-
-    # 1) Zuerst in WebP konvertieren
-    success = convert_image_to_webp(local_path, new_local_path)
-    if not success:
-        await update.message.reply_text("❌ Fehler beim Konvertieren in WebP.")
-        return
-
-    # 2) Upload zum FTP
-    success = await upload_to_ftp(new_local_path, filename)
-    if success:
-        await update.message.reply_text(f"✅ Bild erfolgreich hochgeladen als: {filename}")
+    # Lokale Namen, die wir hochladen wollen (nach Konvertierung), je Ausgabeformat:
+    outputs = {
+        image_format: os.path.join(LOCAL_DOWNLOAD_PATH, with_extension(filename, image_format))
+        for image_format in output_formats()
+    }
+
+    # 1) Einmal dekodieren, in alle Formate kodieren
+    chat_id = update.effective_chat.id
+    encoded = await convert_image(local_path, outputs)
+    if encoded is None:
+        notify(context, chat_id, "❌ Fehler beim Konvertieren in WebP.")
+    # 2) Upload zum FTP: erst WebP, dann die Zusatzformate
+    elif await upload_to_ftp(outputs["webp"], filename):
+        for image_format in encoded:
+            if image_format != "webp":
+                await upload_to_ftp(outputs[image_format], with_extension(filename, image_format))
+        notify(context, chat_id, f"✅ Bild erfolgreich hochgeladen als: {filename}")
     else:
-        await update.message.reply_text("❌ Fehler beim Hochladen des Bildes.")
+        notify(context, chat_id, "❌ Fehler beim Hochladen des Bildes.")
 
     # 3) Lokale Dateien wieder entfernen
-    if os.path.exists(local_path):
-        os.remove(local_path)
-    if os.path.exists(new_local_path):
-        os.remove(new_local_path)
+    active_uploads.discard(os.path.abspath(local_path))
+    for path in [local_path, *outputs.values()]:
+        if os.path.exists(path):
+            os.remove(path)
 
 
-async def handle_month_selection(update: Update, context: CallbackContext):
+async def handle_month_selection(update: Update, context: CallbackContext, payload: CallbackData):
     """
     CallbackQueryHandler, der den ausgewählten Monat entgegennimmt und anschließend nach dem Jahr fragt.
     """
     query = update.callback_query
     await query.answer()
 
-    selected_month = query.data  # z.B. 'Januar', 'Februar', ... oder 'none'
-
-    if selected_month != "none":
+    if 1 <= payload.page <= 12:
+        selected_month = MONTHS[payload.page - 1]
         context.user_data["selected_month"] = selected_month
         await query.edit_message_text(f"Du hast {selected_month} ausgewählt. Bitte gib nun das Jahr ein (z.B. 2024):")
     else:
@@ -674,46 +1919,42 @@ async def multi_step_handler(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ Keine Bearbeitungsaktion gestartet. Bitte wähle zuerst eine Option aus dem Menü.")
         return
 
-    # Wenn eine Bearbeitung eines vorhandenen Bildes läuft:
-    files = context.user_data.get("files", [])
-    selected_image_index = context.user_data.get("selected_image_index")
-    if selected_image_index is None or selected_image_index >= len(files):
-        await update.message.reply_text("❌ Kein gültiges Bild ausgewählt.")
+    # Sammelaktionen aus der Mehrfachauswahl
+    if edit_action == "bulk_material":
+        new_material = update.message.text.strip()
+        if not new_material.isalpha() or "-" in new_material or "_" in new_material:
+            await update.message.reply_text("❌ Material darf nur Buchstaben enthalten. Keine Bindestriche/Unterstriche.")
+            return
+        await run_bulk_operation(context, update.effective_chat.id, "material", new_material)
+        return
+    if edit_action == "bulk_year":
+        year = update.message.text.strip()
+        if not year.isdigit() or len(year) != 4:
+            await update.message.reply_text("❌ Ungültiges Jahr. Bitte gib ein 4-stelliges Jahr ein.")
+            return
+        await run_bulk_operation(context, update.effective_chat.id, "year", year)
         return
 
-    selected_image_name = files[selected_image_index]
-    parts = selected_image_name.rsplit("_", maxsplit=3)  # versuche den Dateinamen in 4 Blöcke zu teilen
-    # Wir müssen die Dateiendung noch isolieren
-    file_extension = ""
-    if "." in parts[-1]:
-        last_part, file_extension = parts[-1].rsplit(".", 1)
-        parts[-1] = last_part
-
-    # Notfallprüfung
-    if len(parts) < 1:
-        await update.message.reply_text("❌ Fehler: Dateiname hat ein unerwartetes Format.")
+    # Wenn eine Bearbeitung eines vorhandenen Bildes läuft:
+    if selected_file(context) is None:
+        await update.message.reply_text("❌ Kein gültiges Bild ausgewählt.")
         return
 
-    # Nun die Bearbeitung:
+    # Änderungen werden nur vorgemerkt und mit „Fertig“ in einer Umbenennung übernommen
+    meta = staged_meta(context)
     if edit_action == "change_title":
         new_title = update.message.text.strip()
         if "-" in new_title or "_" in new_title:
             await update.message.reply_text("❌ Titel darf keine Bindestriche oder Unterstriche enthalten.")
             return
-        parts[0] = encode_title(new_title)
-        await finalize_rename(update, context, parts, file_extension)
+        meta["title"] = encode_title(new_title)
 
     elif edit_action == "change_material":
         new_material = update.message.text.strip()
         if not new_material.isalpha() or "-" in new_material or "_" in new_material:
             await update.message.reply_text("❌ Material darf nur Buchstaben enthalten. Keine Bindestriche/Unterstriche.")
             return
-        # Wir nehmen an, dass parts[1] existiert, sonst müssen wir anpassen
-        if len(parts) < 2:
-            parts.append(new_material)
-        else:
-            parts[1] = new_material
-        await finalize_rename(update, context, parts, file_extension)
+        meta["material"] = new_material
 
     elif edit_action == "change_date":
         # In diesem Flow haben wir schon den Monat per InlineKeyboard:
@@ -730,146 +1971,444 @@ async def multi_step_handler(update: Update, context: CallbackContext):
 
         selected_month = context.user_data["selected_month"]
         if selected_month and selected_month != "none":
-            new_date = f"{selected_month}-{year}"
+            meta["date"] = f"{selected_month}-{year}"
         else:
-            new_date = year  # nur Jahr
-        # Wir nehmen an, das parts[2] existiert
-        if len(parts) < 3:
-            # ggf. auffüllen
-            while len(parts) < 3:
-                parts.append("")  
-        parts[2] = new_date
+            meta["date"] = year  # nur Jahr
         # Aufräumen
         context.user_data.pop("selected_month", None)
-        await finalize_rename(update, context, parts, file_extension)
 
     elif edit_action == "change_dimensions":
         new_dimensions = update.message.text.strip().replace(" ", "")
         if "x" not in new_dimensions or "-" in new_dimensions or "_" in new_dimensions:
             await update.message.reply_text("❌ Maße müssen im Format 'Breite x Höhe' (keine Bindestriche/Unterstriche).")
             return
-        if len(parts) < 4:
-            while len(parts) < 4:
-                parts.append("")  
-        parts[3] = new_dimensions
-        await finalize_rename(update, context, parts, file_extension)
+        meta["dimensions"] = new_dimensions
 
     else:
         await update.message.reply_text("❌ Unbekannte Bearbeitungsaktion.")
         context.user_data["edit_action"] = None
+        return
+
+    context.user_data["edit_action"] = None
+    await update.message.reply_text(
+        staged_preview_text(context),
+        reply_markup=options_keyboard(context.user_data["selected_file_id"], session_nonce(context)),
+    )
+
+
+def staged_meta(context: CallbackContext) -> dict:
+    """
+    Liefert die vorgemerkten Bestandteile des ausgewählten Bildes und legt sie beim ersten
+    Aufruf aus dem aktuellen Dateinamen an.
+    """
+    staged = context.user_data.get("staged")
+    if staged is None or staged["file_id"] != context.user_data.get("selected_file_id"):
+        staged = {"file_id": context.user_data.get("selected_file_id"), "meta": parse_filename(selected_file(context))}
+        context.user_data["staged"] = staged
+    return staged["meta"]
 
 
-async def finalize_rename(update: Update, context: CallbackContext, parts: list, file_extension: str):
+def staged_preview_text(context: CallbackContext) -> str:
     """
-    Hilfsfunktion, um das Umbennen auf dem FTP durchzuführen und dem Nutzer das Ergebnis zu melden.
-    Anschließend werden wieder die Bildoptionen gezeigt.
+    Text mit dem Dateinamen, der sich aus den vorgemerkten Änderungen ergibt.
     """
+    old_name = selected_file(context)
+    new_name = build_filename(staged_meta(context))
+    if new_name == old_name:
+        return f"Keine Änderung vorgemerkt: {old_name}\nBitte wähle eine Bearbeitungsoption:"
+    return (
+        f"📝 Vorschau: {new_name}\n"
+        "Die Änderungen werden mit „Fertig“ in einem Schritt übernommen. Bitte wähle eine Bearbeitungsoption:"
+    )
+
+
+async def commit_staged_changes(context: CallbackContext, chat_id: int):
+    """
+    Übernimmt alle vorgemerkten Änderungen des ausgewählten Bildes mit einer einzigen
+    Umbenennung. Wird es neues Startbild, verliert ein bisheriges Startbild vorher sein _S.
+    Meldungen gehen in die zusammengefasste Nachricht "commit", die der Aufrufer abschließt.
+    """
+    staged = context.user_data.pop("staged", None)
+    old_name = selected_file(context)
+    if staged is None or old_name is None or staged["file_id"] != context.user_data.get("selected_file_id"):
+        return
+    meta = staged["meta"]
+    new_name = build_filename(meta)
+    if new_name == old_name:
+        return
+
     files = context.user_data.get("files", [])
-    selected_image_index = context.user_data.get("selected_image_index")
-    old_name = files[selected_image_index]
-
-    # Neuen Dateinamen zusammenbauen
-    new_name_parts = []
-    for p in parts:
-        if p:  # Nur nicht-leere Teile hinzufügen
-            new_name_parts.append(p)
-    new_name = "_".join(new_name_parts)
-    if file_extension:
-        new_name += f".{file_extension}"
-
-    success = await rename_ftp_file(old_name, new_name)
-    if success:
-        # In der Liste ersetzen
-        files[selected_image_index] = new_name
-        await update.message.reply_text(f"✅ Aktion erfolgreich durchgeführt: {new_name}.")
-    else:
-        await update.message.reply_text("❌ Fehler bei der Durchführung der Aktion.")
+    if new_name in files:
+        notify(context, chat_id, f"❌ {new_name} existiert bereits. Änderungen wurden nicht übernommen.", coalesce="commit")
+        return
 
-    # Bearbeitung beenden
-    context.user_data["edit_action"] = None
-    # Nochmal das Optionen-Menü anbieten:
-    keyboard = [
-        [InlineKeyboardButton("1. Titel ändern", callback_data="edit_title")],
-        [InlineKeyboardButton("2. Material ändern", callback_data="edit_material")],
-        [InlineKeyboardButton("3. Datum ändern", callback_data="edit_date")],
-        [InlineKeyboardButton("4. Maße ändern", callback_data="edit_dimensions")],
-        [InlineKeyboardButton("5. Verfügbarkeit ändern", callback_data="edit_availability")],
-        [InlineKeyboardButton("6. Löschen", callback_data="delete")],
-        [InlineKeyboardButton("7. Startbild festlegen", callback_data="set_start_image")],
-        [InlineKeyboardButton("8. Fertig", callback_data="discard_changes")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Bitte wähle eine Bearbeitungsoption:", reply_markup=reply_markup)
+    if meta["start"] and not parse_filename(old_name)["start"]:
+        # Entferne _S von allen anderen Bildern
+        for i, file in enumerate(files):
+            other = parse_filename(file)
+            if file != old_name and other["start"]:
+                other["start"] = False
+                if await rename_ftp_file(file, build_filename(other)):
+                    files[i] = build_filename(other)
+                    notify(context, chat_id, f"Startbild entfernt: {files[i]}", coalesce="commit")
+        register_files(context, files)
+        context.user_data["selected_file_id"] = file_key(old_name)
+
+    if await rename_ftp_file(old_name, new_name):
+        replace_selected_file(context, new_name)
+        notify(context, chat_id, f"✅ Änderungen übernommen: {new_name}.", coalesce="commit")
+    else:
+        notify(context, chat_id, "❌ Fehler bei der Durchführung der Aktion.", coalesce="commit")
 
 
 # -----------------------------------------
 #   /convert-BEFEHL: ALLE FTP-DATEIEN IN WEBP KONVERTIEREN
 # -----------------------------------------
+def missing_formats(f: str) -> list:
+    """
+    Ausgabeformate, die für eine Datei noch fehlen: bei JPEG/PNG alle, bei WebP die
+    Zusatzformate aus OUTPUT_FORMATS, für die noch keine Geschwisterdatei existiert.
+    """
+    if not f.lower().endswith(".webp"):
+        return list(output_formats())
+    return [
+        image_format for image_format in output_formats()
+        if image_format != "webp" and with_extension(f, image_format) not in remote_locations
+    ]
+
+
+async def convert_file_to_webp(f: str, client=None, executor: ThreadPoolExecutor = None, report: dict = None):
+    """
+    Lädt eine Datei herunter, wandelt sie in die fehlenden Ausgabeformate um (siehe
+    missing_formats()), lädt diese mit gleichem Basisnamen hoch und löscht ein Original, das
+    kein WebP war. Gibt (Erfolg, Fehlermeldung) zurück.
+    Mit executor laufen die Konvertierungen in einem anderen Thread-Pool als dem Encoder-Pool,
+    in report werden Größe und Kodierzeit pro Format aufsummiert (siehe add_to_report()).
+    """
+    local_temp_path = os.path.join(LOCAL_DOWNLOAD_PATH, f)
+    outputs = {
+        image_format: os.path.join(LOCAL_DOWNLOAD_PATH, with_extension(f, image_format))
+        for image_format in missing_formats(f)
+    }
+    try:
+        # Lade die Datei herunter
+        if not await download_from_ftp(f, local_temp_path, client=client):
+            return False, f"Fehler beim Download von {f}."
+
+        # Einmal dekodieren, parallel in alle fehlenden Formate kodieren
+        encoded = await convert_image(local_temp_path, outputs, executor=executor)
+        if encoded is None:
+            return False, f"Fehler beim Konvertieren von {f}."
+        if report is not None:
+            add_to_report(report, encoded)
+
+        # Neue Dateien hochladen (WebP zuerst), dann Original auf FTP löschen
+        for image_format in sorted(encoded, key=lambda fmt: fmt != "webp"):
+            new_name = with_extension(f, image_format)
+            if not await upload_to_ftp(outputs[image_format], new_name, client=client):
+                return False, f"Fehler beim Hochladen von {new_name}."
+        if not f.lower().endswith(".webp"):
+            await delete_ftp_file(f, client=client)
+        return True, None
+    finally:
+        # Lokale Dateien wegräumen
+        for path in (local_temp_path, *outputs.values()):
+            if os.path.exists(path):
+                os.remove(path)
+
+
 async def convert_all_images_to_webp(update: Update, context: CallbackContext):
     """
-    /convert-Befehl: Lädt alle Dateien vom FTP herunter, wandelt sie in WebP um
-    und lädt sie mit gleichem Basisnamen (aber .webp) wieder hoch. Original wird gelöscht.
+    /convert-Befehl: Lädt alle Dateien vom FTP herunter, wandelt sie in WebP (und weitere
+    OUTPUT_FORMATS) um und lädt sie mit gleichem Basisnamen wieder hoch. Original wird gelöscht.
+    Fehlen bei WebP-Dateien Zusatzformate (z.B. AVIF), werden diese nachträglich erzeugt.
+    Am Ende folgt ein Bericht mit Größe und Kodierzeit pro Format.
+    Mit "/convert später" wird die Konvertierung ins nächste Ruhefenster verschoben.
     """
-    await update.message.reply_text("Starte Konvertierung aller Bilder zu WebP ...")
+    chat_id = update.effective_chat.id
+    if context.args and context.args[0].lower() in ("später", "spaeter", "later"):
+        if schedule_background("convert", background_convert, chat_id):
+            await update.message.reply_text(
+                f"Konvertierung wird im nächsten Ruhefenster ({BACKGROUND_WINDOWS}) ausgeführt."
+            )
+        else:
+            await update.message.reply_text("Eine Konvertierung ist bereits eingeplant.")
+        return
+
+    # Alle Statuszeilen eines Laufs landen in einer Nachricht, die fortlaufend editiert wird
+    notify(context, chat_id, "Starte Konvertierung aller Bilder zu WebP ...", coalesce="convert")
     files = await list_ftp_files()
     if not files:
-        await update.message.reply_text("Keine Dateien auf dem FTP gefunden.")
+        notify(context, chat_id, "Keine Dateien auf dem FTP gefunden.", coalesce="convert")
+        get_outbox().end_thread(chat_id, "convert")
         return
 
     converted_count = 0
-    client = await ftp_connect()
+    report = {}
     for f in files:
-        # Prüfe, ob es bereits .webp ist
-        if f.lower().endswith(".webp"):
-            print(f"Datei {f} ist bereits webp, überspringe.")
+        # Prüfe, ob schon alle Formate vorliegen
+        if not missing_formats(f):
+            print(f"Datei {f} liegt bereits in allen Formaten vor, überspringe.")
             continue
 
-        # Lade die Datei herunter
-        local_temp_path = os.path.join(LOCAL_DOWNLOAD_PATH, f)
+        success, error = await convert_file_to_webp(f, report=report)
+        if success:
+            converted_count += 1
+        else:
+            notify(context, chat_id, error, coalesce="convert")
+
+    summary = f"Konvertierung abgeschlossen. {converted_count} Dateien wurden konvertiert."
+    if report:
+        summary += "\n" + format_report(report)
+    print(summary)
+    notify(context, chat_id, summary, coalesce="convert")
+    get_outbox().end_thread(chat_id, "convert")
+    # Timer neu starten
+    start_inactivity_timer()
+
+
+# -----------------------------------------
+#   HINTERGRUNDAUFGABEN IN RUHEFENSTERN
+# -----------------------------------------
+# Schwere Aufgaben (Massenkonvertierung, Aufräumen von ./downloads/, Neuaufbau des Manifests)
+# laufen nur innerhalb von BACKGROUND_WINDOWS und nur, solange niemand mit dem Bot arbeitet.
+# Die Job-Queue der Application prüft dazu regelmäßig, ob die nächste Aufgabe starten darf.
+def parse_time_windows(spec: str) -> list:
+    """
+    Wandelt "01:00-06:00,13:00-14:00" in eine Liste von (Start, Ende)-Zeiten um.
+    """
+    windows = []
+    for part in spec.split(","):
+        if part.strip():
+            start, end = part.strip().split("-")
+            windows.append((datetime.time.fromisoformat(start), datetime.time.fromisoformat(end)))
+    return windows
+
+
+def in_background_window(now: datetime.datetime = None) -> bool:
+    """
+    Prüft, ob der Zeitpunkt in einem Ruhefenster liegt (Fenster über Mitternacht erlaubt).
+    """
+    zoneinfo = lazy_import("zoneinfo")
+    now = now or datetime.datetime.now(zoneinfo.ZoneInfo(BACKGROUND_TIMEZONE))
+    current = now.time()
+    for start, end in parse_time_windows(BACKGROUND_WINDOWS):
+        if start <= end and start <= current < end:
+            return True
+        if start > end and (current >= start or current < end):
+            return True
+    return False
+
+
+def is_idle() -> bool:
+    """
+    True, wenn seit INTERACTIVE_GRACE Sekunden kein Update eines Nutzers eingegangen ist.
+    """
+    return time.monotonic() - last_interaction >= INTERACTIVE_GRACE
+
+
+async def mark_interactive(update: Update, context: CallbackContext):
+    """
+    Läuft vor allen anderen Handlern und merkt sich den Zeitpunkt der letzten Nutzeraktivität.
+    """
+    global last_interaction
+    last_interaction = time.monotonic()
+
+
+async def background_checkpoint():
+    """
+    Wird von Hintergrundaufgaben zwischen zwei Arbeitsschritten aufgerufen und pausiert,
+    solange kein Ruhefenster ist oder Nutzer aktiv sind.
+    """
+    while not (in_background_window() and is_idle()):
+        await asyncio.sleep(BACKGROUND_POLL_INTERVAL)
+
+
+def schedule_background(name: str, func, *args) -> bool:
+    """
+    Reiht eine Hintergrundaufgabe ein. Gleichnamige Aufgaben werden nur einmal eingeplant.
+    func wird als func(context, *args) aufgerufen.
+    """
+    if name == background_running or any(job["name"] == name for job in background_queue):
+        return False
+    background_queue.append({"name": name, "func": func, "args": args})
+    print(f"Hintergrundaufgabe {name} eingeplant.")
+    return True
+
+
+async def background_tick(context: CallbackContext):
+    """
+    Job-Queue-Callback: plant einmal pro Tag die Wartung ein und startet die nächste Aufgabe,
+    wenn gerade ein Ruhefenster ist, niemand aktiv ist und keine andere Aufgabe läuft.
+    """
+    global maintenance_date
+    if not in_background_window():
+        return
+    today = datetime.datetime.now(lazy_import("zoneinfo").ZoneInfo(BACKGROUND_TIMEZONE)).date()
+    if maintenance_date != today:
+        maintenance_date = today
+        schedule_background("cleanup", background_cleanup_downloads)
+        schedule_background("manifest", background_rebuild_manifest)
+    if background_running is None and background_queue and is_idle():
+        job = background_queue.popleft()
+        context.application.create_task(run_background_job(context, job))
+
+
+async def run_background_job(context: CallbackContext, job: dict):
+    global background_running
+    background_running = job["name"]
+    started = time.perf_counter()
+    try:
+        await job["func"](context, *job["args"])
+        print(f"Hintergrundaufgabe {job['name']} beendet ({time.perf_counter() - started:.0f} s).")
+    except Exception as e:
+        print(f"Fehler in Hintergrundaufgabe {job['name']}: {e}")
+    finally:
+        background_running = None
+
+
+async def background_convert(context: CallbackContext, chat_id: int):
+    """
+    Massenkonvertierung (wie /convert) mit eigenen FTP-Verbindungen (BACKGROUND_FTP_SLOTS) und
+    Konvertierungen im eigenen Thread-Pool mit BACKGROUND_CPU_SLOTS Threads.
+    """
+    files = await list_ftp_files()
+    pending = collections.deque(f for f in files if missing_formats(f))
+    total = len(pending)
+    notify(context, chat_id, f"Hintergrund-Konvertierung: {total} Dateien ...", coalesce="convert_bg")
+    converted = 0
+    report = {}
+
+    async def worker():
+        nonlocal converted
+        client = None
         try:
-            await client.download(f, local_temp_path,write_into=True)
-        except Exception as e:
-            await update.message.reply_text(f"Fehler beim Download von {f}: {e}")
+            while pending:
+                if client is not None and not (in_background_window() and is_idle()):
+                    # Vor einer (evtl. stundenlangen) Pause trennen, der Server würde die
+                    # Verbindung sonst wegen Inaktivität kappen.
+                    await close_ftp_client(client)
+                    client = None
+                await background_checkpoint()
+                if not pending:
+                    break
+                if client is None:
+                    try:
+                        client = await open_ftp_client()
+                    except Exception as e:
+                        notify(context, chat_id, f"FTP-Verbindung fehlgeschlagen: {e}", coalesce="convert_bg")
+                        return
+                f = pending.popleft()
+                success, error = await convert_file_to_webp(
+                    f, client=client, executor=get_background_executor(), report=report
+                )
+                if success:
+                    converted += 1
+                else:
+                    notify(context, chat_id, error, coalesce="convert_bg")
+                    # Die Verbindung könnte der Grund sein, für die nächste Datei neu aufbauen.
+                    await close_ftp_client(client)
+                    client = None
+        finally:
+            if client is not None:
+                await close_ftp_client(client)
+
+    await asyncio.gather(*(worker() for _ in range(min(BACKGROUND_FTP_SLOTS, total))))
+    summary = f"Hintergrund-Konvertierung abgeschlossen. {converted} von {total} Dateien konvertiert."
+    if report:
+        summary += "\n" + format_report(report)
+    print(summary)
+    notify(context, chat_id, summary, coalesce="convert_bg")
+    get_outbox().end_thread(chat_id, "convert_bg")
+
+
+async def background_cleanup_downloads(context: CallbackContext):
+    """
+    Entfernt liegengebliebene Dateien aus ./downloads/, die älter als ORPHAN_MAX_AGE Sekunden sind.
+    Fotos, zu denen noch ein Upload-Dialog läuft (active_uploads), bleiben liegen.
+    """
+    removed = 0
+    for entry in os.scandir(LOCAL_DOWNLOAD_PATH):
+        if os.path.abspath(entry.path) in active_uploads:
             continue
+        if entry.is_file() and time.time() - entry.stat().st_mtime > ORPHAN_MAX_AGE:
+            os.remove(entry.path)
+            removed += 1
+    print(f"{removed} verwaiste Dateien aus {LOCAL_DOWNLOAD_PATH} entfernt.")
 
-        # Dateiendung rausfischen
-        base_name, ext = os.path.splitext(f)
-        new_name = base_name + ".webp"
-        local_converted_path = os.path.join(LOCAL_DOWNLOAD_PATH, new_name)
 
-        # Konvertiere nach WebP
-        success = convert_image_to_webp(local_temp_path, local_converted_path)
-        if not success:
-            await update.message.reply_text(f"Fehler beim Konvertieren von {f} nach WebP.")
-            # Lokale Dateien wegräumen
-            if os.path.exists(local_temp_path):
-                print(f"Lösche temporäre Datei {local_temp_path}")
-                try:
-                    os.remove(local_temp_path)
-                except Exception as e:
-                    print(f"Fehler beim Löschen der temporären Datei: {e}")
-            if os.path.exists(local_converted_path):
-                os.remove(local_converted_path)
-            continue
+async def background_rebuild_manifest(context: CallbackContext):
+    """
+    Baut das Galerie-Manifest aus einer vollständigen Auflistung neu auf.
+    """
+    global gallery_entries
+    await background_checkpoint()
+    gallery_entries = None
+    await publish_manifest()
 
-        # WebP wieder hochladen
-        upload_success = await upload_to_ftp(local_converted_path, new_name)
-        if upload_success:
-            converted_count += 1
-            # Original auf FTP löschen
-            await delete_ftp_file(f)
-        else:
-            await update.message.reply_text(f"Fehler beim Hochladen von {new_name}.")
 
-        # Lokale Dateien wegräumen
-        if os.path.exists(local_temp_path):
-            os.remove(local_temp_path)
-        if os.path.exists(local_converted_path):
-            os.remove(local_converted_path)
+# -----------------------------------------
+#   /migrate-BEFEHL: KATALOG IN DIE ABLAGE NACH FTP_LAYOUT VERSCHIEBEN
+# -----------------------------------------
+async def migrate_layout(update: Update, context: CallbackContext):
+    """
+    /migrate-Befehl: Verschiebt alle Dateien, die nicht am Zielpfad laut FTP_LAYOUT liegen,
+    in Paketen von MIGRATION_BATCH_SIZE mit begrenzt parallelen Verbindungen. Der Bot bleibt
+    währenddessen bedienbar, da die gemeinsame FTP-Verbindung nicht blockiert wird.
+    """
+    chat_id = update.effective_chat.id
+    sizes = await list_ftp_file_sizes()
+    if sizes is None:
+        notify(context, chat_id, "❌ Fehler beim Abrufen der Dateien.")
+        return
+    pending = [
+        name for name in sizes
+        if any(locate(f) != remote_path(f) for f in [name, *sibling_files(name)])
+    ]
+    if not pending:
+        notify(context, chat_id, f"Alle Dateien liegen bereits in der Ablage '{FTP_LAYOUT}'.")
+        return
 
-    await update.message.reply_text(f"Konvertierung abgeschlossen. {converted_count} Dateien wurden nach WebP konvertiert.")
-    # Timer neu starten
-    start_inactivity_timer()
+    notify(context, chat_id, f"Starte Migration von {len(pending)} Dateien nach '{FTP_LAYOUT}' ...", coalesce="migrate")
+    moved = 0
+    failed = []
+    for start_index in range(0, len(pending), MIGRATION_BATCH_SIZE):
+        batch = pending[start_index:start_index + MIGRATION_BATCH_SIZE]
+        results = await run_ftp_batch([(rename_ftp_file, name, name) for name in batch])
+        moved += sum(results)
+        failed.extend(name for name, success in zip(batch, results) if not success)
+        notify(context, chat_id, f"{moved + len(failed)}/{len(pending)} verarbeitet.", coalesce="migrate")
+
+    notify(context, chat_id, f"Migration abgeschlossen. {moved} Dateien verschoben.", coalesce="migrate")
+    if failed:
+        notify(context, chat_id, "❌ Fehlgeschlagen:\n" + "\n".join(failed), coalesce="migrate")
+    get_outbox().end_thread(chat_id, "migrate")
+
+
+# Aktionscode → Handler für dispatch_callback()
+CALLBACK_ACTIONS = {
+    "p": show_list_page,
+    "s": show_image_options,
+    "t": change_title,
+    "m": change_material,
+    "d": change_date,
+    "w": change_dimensions,
+    "v": change_availability,
+    "x": delete_image,
+    "S": set_start_image,
+    "f": discard_changes,
+    "a": set_availability,
+    "u": set_availability,
+    "M": handle_month_selection,
+    "B": start_bulk_selection,
+    "b": toggle_bulk_selection,
+    "A": bulk_action,
+    "U": bulk_action,
+    "N": bulk_action,
+    "Y": bulk_action,
+    "D": bulk_action,
+    "X": bulk_action,
+}
 
 
 # -----------------------------------------
@@ -878,12 +2417,39 @@ async def convert_all_images_to_webp(update: Update, context: CallbackContext):
 def parse_args():
     parser = argparse.ArgumentParser(description="Start the bot in either local or webhook mode.")
     parser.add_argument("--local", action="store_true", help="Run the bot in local polling mode.")
+    parser.add_argument(
+        "--no-prewarm",
+        action="store_true",
+        help="Do not prewarm the FTP connection and encoder workers after startup.",
+    )
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
-    application = Application.builder().token(BOT_TOKEN).build()
+def build_application(prewarm: bool = True, request=None, get_updates_request=None):
+    """
+    Baut die Application mit allen Handlern und Jobs. Für Lasttests können eigene
+    Request-Objekte (z.B. eine nachgebildete Bot API) übergeben werden.
+    """
+    telegram_ext = lazy_import("telegram.ext")
+    Application = telegram_ext.Application
+    CommandHandler = telegram_ext.CommandHandler
+    MessageHandler = telegram_ext.MessageHandler
+    CallbackQueryHandler = telegram_ext.CallbackQueryHandler
+    TypeHandler = telegram_ext.TypeHandler
+    filters = telegram_ext.filters
+    User = filters.User
+
+    builder = Application.builder().token(BOT_TOKEN).post_stop(post_stop).post_shutdown(post_shutdown)
+    if prewarm:
+        builder = builder.post_init(post_init)
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    application = builder.build()
+
+    # Nutzeraktivität merken (pausiert Hintergrundaufgaben)
+    application.add_handler(TypeHandler(lazy_import("telegram").Update, mark_interactive), group=-1)
 
     # Start/Hilfe
     application.add_handler(CommandHandler("start", start))
@@ -891,28 +2457,9 @@ def main():
 
     # Bilder auflisten, Optionen anzeigen
     application.add_handler(CommandHandler("list", list_images, filters=User(ADMINISTRATOR_IDS)))
-    application.add_handler(CallbackQueryHandler(show_image_options, pattern="select_"))
-
-    # Bearbeitungsoptionen
-    application.add_handler(CallbackQueryHandler(change_title, pattern="edit_title"))
-    application.add_handler(CallbackQueryHandler(change_material, pattern="edit_material"))
-    application.add_handler(CallbackQueryHandler(change_date, pattern="edit_date"))
-    application.add_handler(CallbackQueryHandler(change_availability, pattern="edit_availability"))
-    application.add_handler(CallbackQueryHandler(change_dimensions, pattern="edit_dimensions"))
-    application.add_handler(CallbackQueryHandler(set_start_image, pattern="set_start_image"))
-    application.add_handler(CallbackQueryHandler(delete_image, pattern="delete"))
-    application.add_handler(CallbackQueryHandler(discard_changes, pattern="discard_changes"))
-
-    # Verfügbarkeit
-    application.add_handler(CallbackQueryHandler(set_availability, pattern="set_available|set_unavailable"))
-
-    # Monat für Datum beim Hochladen oder nachträglich ändern
-    application.add_handler(
-        CallbackQueryHandler(
-            handle_month_selection,
-            pattern="Januar|Februar|März|April|Mai|Juni|Juli|August|September|Oktober|November|Dezember|none"
-        )
-    )
+
+    # Alle Inline-Buttons (Liste, Bearbeitung, Verfügbarkeit, Monat) über einen Dispatcher
+    application.add_handler(CallbackQueryHandler(dispatch_callback))
 
     # Multi-Step-Eingaben (Titel/Material/Datum usw.)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, multi_step_handler))
@@ -927,6 +2474,26 @@ def main():
     # /convert
     application.add_handler(CommandHandler("convert", convert_all_images_to_webp, filters=User(ADMINISTRATOR_IDS)))
 
+    # /migrate
+    application.add_handler(CommandHandler("migrate", migrate_layout, filters=User(ADMINISTRATOR_IDS)))
+
+    # Hintergrundaufgaben in Ruhefenstern
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(background_tick, interval=BACKGROUND_POLL_INTERVAL, first=BACKGROUND_POLL_INTERVAL)
+    else:
+        print("Job-Queue nicht verfügbar (python-telegram-bot[job-queue]), Hintergrundaufgaben deaktiviert.")
+
+    print(
+        f"Startzeit bis Handler-Registrierung: {(time.perf_counter() - _MODULE_LOAD_START) * 1000:.0f} ms "
+        f"(davon Importe: {sum(import_times.values()) * 1000:.0f} ms)."
+    )
+    return application
+
+
+def main():
+    args = parse_args()
+    application = build_application(prewarm=not args.no_prewarm)
+
     # Webhook vs. Polling
     if args.local:
         print("Bot läuft im lokalen Polling-Modus.")
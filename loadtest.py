@@ -0,0 +1,441 @@
+"""
+Lasttest für den Bot.
+
+Baut die Application wie main() über bot.build_application(), ersetzt die Telegram Bot API durch
+eine im Prozess nachgebildete API (FakeBotApi) und den FTP-Server durch einen lokalen aioftp-Server
+auf einem temporären Verzeichnis. Danach werden Updates mit einstellbarer Rate eingespielt:
+
+- synthetisch: mehrere Admins durchlaufen parallel Upload, Liste/Bearbeiten/Bestätigen,
+  Blättern und /convert (Gewichtung über --mix)
+- aufgezeichnet: eine JSONL-Datei mit einem Telegram-Update pro Zeile (--replay)
+
+Ausgegeben werden pro Handler Anzahl, Fehler und p50/p95/p99-Latenz, die Ende-zu-Ende-Latenz pro
+Schritt (von der Update-Queue bis zum Ende aller Handler) sowie Durchsatz und Fehlerquote.
+
+Aufruf:
+    python loadtest.py
+    python loadtest.py --admins 8 --duration 60 --rate 20 --mix upload=2,edit=3,browse=4,convert=1
+    python loadtest.py --replay updates.jsonl --rate 50 --json baseline.json
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import random
+import socket
+import asyncio
+import argparse
+import itertools
+import tempfile
+import functools
+import collections
+
+DEFAULT_MIX = "upload=2,edit=3,browse=4,convert=1"
+STEP_TIMEOUT = 120
+
+
+def percentile(values: list, p: float) -> float:
+    # Nearest-Rank-Verfahren auf den sortierten Werten
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_photo(size: str) -> bytes:
+    from PIL import Image
+    width, height = (int(v) for v in size.split("x"))
+    img = Image.effect_noise((width, height), 48).convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class Stats:
+    """
+    Sammelt Latenzen (Sekunden) und Fehler pro Handler bzw. pro Schritt.
+    """
+
+    def __init__(self):
+        self.handlers = collections.defaultdict(list)
+        self.handler_errors = collections.Counter()
+        self.steps = collections.defaultdict(list)
+        self.step_errors = collections.Counter()
+
+    def summary(self) -> dict:
+        def table(samples, errors):
+            return {
+                name: {
+                    "count": len(values),
+                    "errors": errors[name],
+                    "p50_ms": percentile(values, 50) * 1000 if values else None,
+                    "p95_ms": percentile(values, 95) * 1000 if values else None,
+                    "p99_ms": percentile(values, 99) * 1000 if values else None,
+                }
+                for name, values in sorted(samples.items())
+            }
+        return {"handlers": table(self.handlers, self.handler_errors), "steps": table(self.steps, self.step_errors)}
+
+
+def timed(stats: Stats, name: str, func):
+    """
+    Umhüllt einen Handler-Callback und misst dessen Laufzeit.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            stats.handler_errors[name] += 1
+            raise
+        finally:
+            stats.handlers[name].append(time.perf_counter() - started)
+    return wrapper
+
+
+def fake_bot_api_class():
+    from telegram.request import BaseRequest
+
+    class FakeBotApi(BaseRequest):
+        """
+        Beantwortet Bot-API-Aufrufe im Prozess und merkt sich die letzte Tastatur pro Chat.
+        Mit `latency` (Sekunden) wird die Netzwerklaufzeit zu Telegram nachgestellt.
+        """
+        read_timeout = None
+
+        def __init__(self, latency: float, photo: bytes):
+            self.latency = latency
+            self.photo = photo
+            self.calls = collections.Counter()
+            self.markups = {}
+            self.message_ids = itertools.count(1000)
+            self.file_ids = itertools.count(1)
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if "/file/bot" in url:
+                return 200, self.photo
+            name = url.rsplit("/", 1)[1]
+            params = request_data.parameters if request_data else {}
+            self.calls[name] += 1
+            chat = {"id": int(params.get("chat_id", 0) or 0), "type": "private"}
+            if name == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Lasttest", "username": "loadtest_bot"}
+            elif name in ("sendMessage", "editMessageText", "editMessageReplyMarkup", "sendPhoto"):
+                result = {"message_id": next(self.message_ids), "date": 0, "chat": chat, "text": params.get("text", "")}
+                markup = params.get("reply_markup")
+                if markup:
+                    self.markups[chat["id"]] = json.loads(markup) if isinstance(markup, str) else markup
+            elif name == "sendMediaGroup":
+                media = params["media"]
+                media = json.loads(media) if isinstance(media, str) else media
+                result = [
+                    {"message_id": next(self.message_ids), "date": 0, "chat": chat,
+                     "photo": [{"file_id": f"preview{i}", "file_unique_id": f"preview{i}", "width": 1, "height": 1}]}
+                    for i, _ in enumerate(media)
+                ]
+            elif name == "getFile":
+                result = {"file_id": params["file_id"], "file_unique_id": params["file_id"],
+                          "file_path": f"photos/file_{next(self.file_ids)}.jpg"}
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return FakeBotApi
+
+
+class LoadTest:
+    """
+    Spielt Updates in die Update-Queue der Application ein und wartet auf deren Abschluss.
+    """
+
+    def __init__(self, bot, application, api, stats: Stats, rate: float):
+        from telegram import Update
+        self.bot = bot
+        self.application = application
+        self.api = api
+        self.stats = stats
+        self.bucket = bot.TokenBucket(rate, 1.0) if rate else None
+        self.update_ids = itertools.count(1)
+        self.pending = {}
+        self.failed = set()
+        self.attempts = 0
+        self.Update = Update
+
+    async def done(self, update, context):
+        future = self.pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def error(self, update, context):
+        # Fehlerhandler der Application: merkt sich Updates, bei denen ein Handler abgebrochen ist
+        if isinstance(update, self.Update):
+            self.failed.add(update.update_id)
+        print(f"Fehler im Handler: {context.error!r}")
+
+    async def send(self, step: str, payload: dict) -> bool:
+        """
+        Stellt ein Update ein und wartet, bis alle Handler durchgelaufen sind.
+        """
+        if self.bucket is not None:
+            while (wait := self.bucket.wait_time()) > 0:
+                await asyncio.sleep(wait)
+        self.attempts += 1
+        payload = dict(payload, update_id=next(self.update_ids))
+        future = asyncio.get_running_loop().create_future()
+        self.pending[payload["update_id"]] = future
+        started = time.perf_counter()
+        await self.application.update_queue.put(self.Update.de_json(payload, self.application.bot))
+        try:
+            finished = await asyncio.wait_for(future, STEP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.pending.pop(payload["update_id"], None)
+            self.stats.step_errors[step] += 1
+            return False
+        self.stats.steps[step].append(finished - started)
+        if payload["update_id"] in self.failed:
+            self.stats.step_errors[step] += 1
+        return True
+
+    # --- Bausteine für Updates ---
+    def message(self, admin: int, text: str = None, photo: bool = False) -> dict:
+        message = {
+            "message_id": next(self.update_ids), "date": int(time.time()),
+            "chat": {"id": admin, "type": "private"},
+            "from": {"id": admin, "is_bot": False, "first_name": f"Admin{admin}"},
+        }
+        if photo:
+            message["photo"] = [{"file_id": f"photo{admin}_{message['message_id']}", "file_unique_id": "p",
+                                 "width": 1600, "height": 1200}]
+        else:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": message}
+
+    def callback(self, admin: int, data: str) -> dict:
+        return {"callback_query": {
+            "id": str(next(self.update_ids)), "chat_instance": str(admin), "data": data,
+            "from": {"id": admin, "is_bot": False, "first_name": f"Admin{admin}"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": admin, "type": "private"}, "text": "-"},
+        }}
+
+    def buttons(self, admin: int, action: str) -> list:
+        markup = self.api.markups.get(admin) or {}
+        found = []
+        for row in markup.get("inline_keyboard", []):
+            for button in row:
+                payload = self.bot.decode_callback(button.get("callback_data", ""))
+                if payload and payload.action == action:
+                    found.append(button["callback_data"])
+        return found
+
+    async def click(self, admin: int, step: str, action: str) -> bool:
+        options = self.buttons(admin, action)
+        if not options:
+            # Erwarteter Button fehlt: zählt als fehlgeschlagener Schritt
+            self.attempts += 1
+            self.stats.step_errors[step] += 1
+            return False
+        return await self.send(step, self.callback(admin, random.choice(options)))
+
+    # --- Synthetische Abläufe ---
+    async def flow_upload(self, admin: int, n: int):
+        await self.send("upload:photo", self.message(admin, photo=True))
+        await self.send("upload:title", self.message(admin, f"Last{admin}x{n}"))
+        await self.send("upload:material", self.message(admin, "Acryl"))
+        await self.click(admin, "upload:month", "M")
+        await self.send("upload:year", self.message(admin, "2024"))
+        await self.send("upload:dimensions", self.message(admin, "30x40"))
+
+    async def flow_edit(self, admin: int, n: int):
+        await self.send("edit:list", self.message(admin, "/list"))
+        if not await self.click(admin, "edit:select", "s"):
+            return
+        await self.click(admin, "edit:title", "t")
+        await self.send("edit:title_text", self.message(admin, f"Neu{admin}x{n}"))
+        await self.click(admin, "edit:start_image", "S")
+        await self.send("edit:confirm", self.message(admin, "/confirm"))
+        await self.click(admin, "edit:finish", "f")
+
+    async def flow_browse(self, admin: int, n: int):
+        await self.send("browse:list", self.message(admin, "/list"))
+        for _ in range(3):
+            if not self.buttons(admin, "p"):
+                break
+            await self.click(admin, "browse:page", "p")
+        if await self.click(admin, "browse:select", "s"):
+            await self.click(admin, "browse:finish", "f")
+
+    async def flow_convert(self, admin: int, n: int):
+        await self.send("convert", self.message(admin, "/convert"))
+
+    async def run_admin(self, admin: int, mix: dict, deadline: float, think: float):
+        flows = [getattr(self, f"flow_{name}") for name in mix]
+        weights = list(mix.values())
+        for n in itertools.count():
+            if time.perf_counter() >= deadline:
+                break
+            await random.choices(flows, weights)[0](admin, n)
+            if think:
+                await asyncio.sleep(random.uniform(0, think))
+
+    async def replay(self, path: str):
+        """
+        Spielt aufgezeichnete Updates ein. Buttons aus einer anderen Sitzung laufen dabei
+        in den Pfad für abgelaufene Buttons, so wie im Betrieb nach einem Neustart.
+        """
+        tasks = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    payload = json.loads(line)
+                    kind = "callback" if "callback_query" in payload else "message"
+                    tasks.append(asyncio.create_task(self.send(f"replay:{kind}", payload)))
+                    await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+
+def print_table(title: str, table: dict):
+    print(f"\n{title}")
+    print(f"{'Name':<28} {'Anzahl':>7} {'Fehler':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in table.items():
+        if row["count"]:
+            print(f"{name:<28} {row['count']:>7} {row['errors']:>7} "
+                  f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+        else:
+            print(f"{name:<28} {0:>7} {row['errors']:>7} {'-':>9} {'-':>9} {'-':>9}")
+
+
+async def run(args, workdir: str):
+    import aioftp
+    from PIL import Image
+    root = os.path.join(workdir, "ftp")
+    os.makedirs(root)
+    for i in range(args.seed_files):
+        # Jede vierte Datei als JPEG, damit /convert etwas zu tun hat
+        extension = "jpg" if i % 4 == 0 else "webp"
+        Image.effect_noise((400, 300), 48).convert("RGB").save(
+            os.path.join(root, f"Bestand{i}_Öl_Mai-2020_30-40.{extension}"), quality=85
+        )
+    server = aioftp.Server([aioftp.User(os.environ["FTP_USER"], os.environ["FTP_PASS"], base_path=root)])
+    await server.start("127.0.0.1", int(os.environ["FTP_PORT"]))
+
+    import bot
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    api = fake_bot_api_class()(args.api_latency / 1000, make_photo(args.photo_size))
+    application = bot.build_application(prewarm=False, request=api, get_updates_request=api)
+    stats = Stats()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed(stats, handler.callback.__name__, handler.callback)
+    for action, func in bot.CALLBACK_ACTIONS.items():
+        bot.CALLBACK_ACTIONS[action] = timed(stats, f"{func.__name__} ({action})", func)
+
+    test = LoadTest(bot, application, api, stats, args.rate)
+    # Letzte Gruppe: meldet, dass alle Handler für dieses Update durchgelaufen sind
+    application.add_handler(TypeHandler(Update, test.done), group=1000)
+    application.add_error_handler(test.error)
+
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    if args.replay:
+        await test.replay(args.replay)
+    else:
+        mix = {name: float(weight) for name, weight in (part.split("=") for part in args.mix.split(","))}
+        mix = {name: weight for name, weight in mix.items() if weight > 0}
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            test.run_admin(admin, mix, deadline, args.think / 1000) for admin in bot.ADMINISTRATOR_IDS
+        ))
+    elapsed = time.perf_counter() - started
+    await bot.get_outbox().drain()
+    await application.stop()
+    await application.shutdown()
+    await bot.ftp_disconnect()
+    await server.close()
+
+    summary = stats.summary()
+    total = test.attempts
+    failed = sum(stats.step_errors.values())
+    summary["total"] = {
+        "updates": total,
+        "seconds": elapsed,
+        "updates_per_second": total / elapsed if elapsed else 0.0,
+        "error_rate": failed / total if total else 0.0,
+        "api_calls": dict(api.calls),
+    }
+    print_table("Handler (Laufzeit des Callbacks)", summary["handlers"])
+    print_table("Schritte (Ende-zu-Ende ab Update-Queue)", summary["steps"])
+    print(
+        f"\n{total} Updates in {elapsed:.1f} s → {summary['total']['updates_per_second']:.1f} Updates/s, "
+        f"Fehlerquote {summary['total']['error_rate'] * 100:.1f} %"
+    )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lasttest mit nachgebildeter Bot API und lokalem FTP-Server.")
+    parser.add_argument("--admins", type=int, default=4, help="Anzahl gleichzeitiger Admins.")
+    parser.add_argument("--duration", type=float, default=30, help="Dauer der synthetischen Last in Sekunden.")
+    parser.add_argument("--rate", type=float, default=0, help="Maximale Updates pro Sekunde insgesamt (0 = unbegrenzt).")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Gewichtung der Abläufe upload/edit/browse/convert.")
+    parser.add_argument("--think", type=float, default=0, help="Maximale Denkpause zwischen Abläufen in ms.")
+    parser.add_argument("--replay", help="JSONL-Datei mit aufgezeichneten Updates statt synthetischer Last.")
+    parser.add_argument("--seed-files", type=int, default=40, help="Anzahl Bilder auf dem FTP zu Beginn.")
+    parser.add_argument("--photo-size", default="1600x1200", help="Größe der hochgeladenen Fotos (BxH).")
+    parser.add_argument("--api-latency", type=float, default=0, help="Antwortzeit der Bot API in ms.")
+    parser.add_argument("--json", help="Ergebnisse zusätzlich als JSON speichern (Baseline).")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if args.replay:
+        args.replay = os.path.abspath(args.replay)
+
+    admin_ids = [1000 + i for i in range(max(1, args.admins))]
+    if args.replay:
+        # Absender der Aufzeichnung als Admins eintragen, sonst greifen die Filter nicht
+        with open(args.replay, encoding="utf-8") as f:
+            senders = {
+                (update.get("message") or update.get("callback_query") or {}).get("from", {}).get("id")
+                for update in map(json.loads, filter(str.strip, f))
+            }
+        admin_ids = sorted(i for i in senders if i) or admin_ids
+
+    # bot.py liest seine Konfiguration beim Import
+    os.environ.update({
+        "BOT_TOKEN": "123456:loadtest",
+        "FTP_HOST": "127.0.0.1",
+        "FTP_PORT": str(free_port()),
+        "FTP_USER": "loadtest",
+        "FTP_PASS": "loadtest",
+        "ADMINISTRATOR_IDS": ",".join(map(str, admin_ids)),
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        # ./downloads/ des Bots landet im temporären Verzeichnis
+        os.chdir(tmp)
+        asyncio.run(run(args, tmp))
+
+
+if __name__ == "__main__":
+    main()